@@ -0,0 +1,82 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker
+
+from wikidict import CONTENT_FORMAT, migrate_database, set_sqlite_profile, delete_database
+from wikidict.model import Base, WikiPage
+
+
+class TestMigrateDatabase(TestCase):
+
+    def setUp(self) -> None:
+        fd, self.db_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.engine = create_engine('sqlite:///{}'.format(self.db_path))
+
+    def tearDown(self) -> None:
+        self.engine.dispose()
+        os.remove(self.db_path)
+
+    def test_migrate_adds_indexes(self):
+        with self.engine.connect() as connection:
+            connection.execute('CREATE TABLE pages (id INTEGER PRIMARY KEY, revision_id INTEGER, '
+                               'latest_revision_online INTEGER, content TEXT, title VARCHAR(64), '
+                               'redirect_to_id INTEGER REFERENCES pages (id))')
+            connection.execute("INSERT INTO pages (id, title) VALUES (1, 'Title')")
+            connection.execute("INSERT INTO pages (id, title, content) VALUES (2, 'Other', '#REDIRECT [[Title]]')")
+
+        migrate_database(self.engine)
+
+        inspector = inspect(self.engine)
+        self.assertEqual({'ix_pages_title', 'ix_pages_redirect_to_id'},
+                         {index['name'] for index in inspector.get_indexes('pages')})
+        self.assertEqual({'ix_category_association_page_id', 'ix_category_association_category_id'},
+                         {index['name'] for index in inspector.get_indexes('category_association')})
+        self.assertEqual([(1, None), (2, 'Title')],
+                         self.engine.execute('SELECT id, redirect_title FROM pages ORDER BY id').fetchall())
+        self.assertEqual(['null', 'blob'],
+                         [row[0] for row in self.engine.execute('SELECT typeof(content) FROM pages ORDER BY id')])
+        self.assertEqual('#REDIRECT [[Title]]', self.engine.execute(
+            WikiPage.__table__.select().with_only_columns([WikiPage.content]).where(WikiPage.id == 2)).scalar())
+
+    def test_migrate_up_to_date(self):
+        Base.metadata.create_all(self.engine)
+        migrate_database(self.engine)
+        self.assertEqual(2, len(inspect(self.engine).get_indexes('pages')))
+
+    def test_migrate_content_format(self):
+        Base.metadata.create_all(self.engine)
+        self.engine.execute("INSERT INTO sync_state (name, value) VALUES ('content_format', 'zlib')")
+        migrate_database(self.engine)
+        self.assertEqual(CONTENT_FORMAT, self.engine.execute(
+            "SELECT value FROM sync_state WHERE name = 'content_format'").scalar())
+
+
+class TestSqliteProfile(TestCase):
+
+    def test_set_sqlite_profile(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine = create_engine('sqlite:///{}'.format(os.path.join(tmp_dir, 'test.db')))
+            set_sqlite_profile(engine, 'bulk')
+            with engine.connect() as connection:
+                self.assertEqual('wal', connection.execute('PRAGMA journal_mode').scalar())
+                self.assertEqual(0, connection.execute('PRAGMA synchronous').scalar())
+                self.assertEqual(1, connection.execute('PRAGMA foreign_keys').scalar())
+            engine.dispose()
+
+    def test_delete_database(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'test.db')
+            engine = create_engine('sqlite:///{}'.format(db_path))
+            set_sqlite_profile(engine, 'default')
+            Base.metadata.create_all(engine)
+            for suffix in ('-wal', '-shm'):
+                with open(db_path + suffix, 'wb') as f:
+                    f.write(b'stale')
+
+            delete_database(sessionmaker(bind=engine)())
+            self.assertEqual([], os.listdir(tmp_dir))
+            delete_database(sessionmaker(bind=engine)())
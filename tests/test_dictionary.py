@@ -0,0 +1,85 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from tests import session, engine
+from wikidict import dictionary
+from wikidict.dictionary import Dictionary
+from wikidict.model import WikiPage, Category, Base, RenderedEntry, category_association
+
+
+class TestDictionary(TestCase):
+
+    def setUp(self) -> None:
+        session.expunge_all()
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+
+        cat = Category(name='Characters')
+        target = WikiPage(id=1, title='Mance Rayder', content="'''Mance''' is [[King-Beyond-the-Wall]].",
+                          categories=[cat])
+        session.add_all([
+            target,
+            WikiPage(id=2, title='Abel', content='#REDIRECT [[Mance Rayder]]', redirect_to=target),
+            WikiPage(id=3, title='Aegon', content='{{Infobox}}Aegon\n==History==\nMore', revision_id=10),
+        ])
+        session.commit()
+
+    def test_entries(self):
+        entries = list(Dictionary(session).entries(batch_size=1))
+        self.assertEqual(['Aegon', 'Mance Rayder'], [e.title for e in entries])
+        self.assertEqual(['Characters'], entries[1].categories)
+        self.assertEqual(['Abel'], entries[1].variants)
+
+    def test_entry_category_order(self):
+        session.add_all([Category(id=10, name='Zeta'), Category(id=11, name='Alpha')])
+        session.commit()
+        session.execute(category_association.delete().where(category_association.c.page_id == 1))
+        session.execute(category_association.insert(), [{'page_id': 1, 'category_id': category_id}
+                                                        for category_id in (11, 10)])
+        session.commit()
+        self.assertEqual(['Alpha', 'Zeta'], list(Dictionary(session).entries())[1].categories)
+
+    def test_save(self):
+        fd, file_path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            Dictionary(session).save(file_path)
+            with open(file_path) as f:
+                content = f.read()
+        finally:
+            os.remove(file_path)
+
+        self.assertEqual(
+            "@ Aegon\nAegon\n\n"
+            "@ Mance Rayder\n: Characters\n& Abel\n**Mance** is [King-Beyond-the-Wall](#king-beyond-the-wall).\n\n",
+            content)
+
+    def test_jobs(self):
+        for use_cache in (False, True):
+            with self.subTest(use_cache=use_cache):
+                session.query(RenderedEntry).delete()
+                session.commit()
+                single = [e.format() for e in Dictionary(session, use_cache=use_cache).entries(batch_size=1)]
+                cached = [(e.page_id, e.body) for e in session.query(RenderedEntry).order_by(RenderedEntry.page_id)]
+
+                session.query(RenderedEntry).delete()
+                session.commit()
+                parallel = [e.format() for e in Dictionary(session, use_cache=use_cache, jobs=2).entries(batch_size=1)]
+                self.assertEqual(single, parallel)
+                self.assertEqual(cached, [(e.page_id, e.body) for e
+                                          in session.query(RenderedEntry).order_by(RenderedEntry.page_id)])
+
+    def test_render_cache(self):
+        first = [e.format() for e in Dictionary(session).entries()]
+        self.assertEqual(1, session.query(RenderedEntry).count())
+
+        with patch.object(dictionary, 'render_kobo_body', wraps=dictionary.render_kobo_body) as render:
+            self.assertEqual(first, [e.format() for e in Dictionary(session).entries()])
+            self.assertEqual(1, render.call_count)  # Page without revision ID is not cached
+
+            session.query(WikiPage).filter(WikiPage.id == 3).update({'content': 'Aegon II', 'revision_id': 11})
+            session.commit()
+            self.assertEqual('@ Aegon\nAegon II\n\n', next(Dictionary(session).entries()).format())
+            self.assertEqual(3, render.call_count)
@@ -0,0 +1,64 @@
+import bz2
+import os
+import tempfile
+from unittest import TestCase
+
+from wikidict.dump import DumpImporter
+from wikidict.model import Base, WikiPage, Category
+
+from tests import session, engine
+
+DUMP_PATH = os.path.join(os.path.dirname(__file__), 'data', 'pages-articles.xml')
+
+
+class TestDumpImporter(TestCase):
+
+    def setUp(self) -> None:
+        session.expunge_all()
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+
+    def test_import_dump(self):
+        n_pages = DumpImporter(batch_size=2).import_dump(session, DUMP_PATH)
+        self.assertEqual(3, n_pages)
+
+        jon = session.query(WikiPage).get(10)
+        self.assertEqual('Jon Snow', jon.title)
+        self.assertEqual(1001, jon.revision_id)
+        self.assertEqual(1001, jon.latest_revision_online)
+        self.assertTrue(jon.content.startswith("'''Jon Snow'''"))
+        self.assertEqual(["Members of the Night's Watch", 'Bastards'], [c.name for c in jon.categories])
+
+        redirect = session.query(WikiPage).get(11)
+        self.assertEqual('Jon Snow', redirect.redirect_title)
+        self.assertEqual(jon, redirect.redirect_to)
+
+        self.assertIsNone(session.query(WikiPage).get(12))
+        self.assertEqual(['Bastards'], [c.name for c in session.query(WikiPage).get(13).categories])
+        self.assertEqual(2, session.query(Category).count())
+
+    def test_import_older_dump(self):
+        session.add_all([
+            WikiPage(id=10, title='Jon Snow', revision_id=2000, latest_revision_online=2001, content='Newer content'),
+            WikiPage(id=11, title='Lord Snow', latest_revision_online=5000),
+            WikiPage(id=13, title='Ghost', revision_id=900, latest_revision_online=5000),
+        ])
+        session.commit()
+
+        self.assertEqual(2, DumpImporter().import_dump(session, DUMP_PATH))
+        session.expunge_all()
+        jon = session.query(WikiPage).get(10)
+        self.assertEqual((2000, 2001, 'Newer content'), (jon.revision_id, jon.latest_revision_online, jon.content))
+        self.assertEqual([], jon.categories)
+        # Dump is stored, but pages with newer revisions online stay outdated
+        self.assertEqual([(11, 1002, 5000), (13, 1004, 5000)],
+                         session.query(WikiPage.id, WikiPage.revision_id, WikiPage.latest_revision_online)
+                         .filter(WikiPage.id.in_([11, 13])).order_by(WikiPage.id).all())
+
+    def test_import_compressed_dump(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bz2_path = os.path.join(tmp_dir, 'pages-articles.xml.bz2')
+            with open(DUMP_PATH, 'rb') as f, bz2.open(bz2_path, 'wb') as out:
+                out.write(f.read())
+            DumpImporter().import_dump(session, bz2_path)
+        self.assertEqual(3, session.query(WikiPage).count())
@@ -1,7 +1,10 @@
 from unittest import TestCase
 
+from sqlalchemy import inspect
+
 from tests import session, engine
-from wikidict.model import WikiPage, Category, Base, get_or_create
+from wikidict.model import WikiPage, Category, Base, get_or_create, upsert, CategoryCache, get_state, set_state, \
+    iter_page_ids
 
 
 class TestWikiPage(TestCase):
@@ -40,3 +43,74 @@ class TestWikiPage(TestCase):
         session.commit()
 
         self.assertEqual(cat2, session.query(Category).filter_by(name='cat2').first())
+
+    def test_upsert(self):
+        session.add(WikiPage(id=1, title='Old title', revision_id=10, latest_revision_online=10))
+        session.commit()
+
+        upsert(session, WikiPage.__table__, [
+            {'id': 1, 'title': 'New title'},
+            {'id': 2, 'title': 'Second'},
+            {'id': 3, 'latest_revision_online': 30},
+        ])
+        session.commit()
+
+        page = session.query(WikiPage).get(1)
+        self.assertEqual(('New title', 10, 10), (page.title, page.revision_id, page.latest_revision_online))
+        self.assertEqual('Second', session.query(WikiPage).get(2).title)
+        self.assertEqual(30, session.query(WikiPage).get(3).latest_revision_online)
+
+    def test_compressed_content(self):
+        content = "'''Title''' is a [[Link]].\n== Heading ==\n[[Category:Cat]]"
+        upsert(session, WikiPage.__table__, [{'id': 1, 'content': content}])
+        session.execute("INSERT INTO pages (id, content) VALUES (2, 'Legacy text')")
+        session.commit()
+
+        self.assertEqual(bytes, type(session.execute('SELECT content FROM pages WHERE id = 1').scalar()))
+        self.assertEqual(content, session.query(WikiPage.content).filter(WikiPage.id == 1).scalar())
+        self.assertEqual('Legacy text', session.query(WikiPage).get(2).content)
+
+    def test_content_deferred(self):
+        session.add(WikiPage(id=1, title='Title', content='Content'))
+        session.commit()
+        session.expunge_all()
+
+        page = session.query(WikiPage).get(1)
+        self.assertIn('content', inspect(page).unloaded)
+        self.assertEqual('Content', page.content)
+
+    def test_iter_page_ids(self):
+        upsert(session, WikiPage.__table__, [{'id': i, 'revision_id': None} for i in range(1, 8)])
+        session.commit()
+
+        page_ids = []
+        for page_id in iter_page_ids(session, WikiPage.revision_id == None, batch_size=3):  # noqa: E711
+            page_ids.append(page_id)
+            if page_id == 2:
+                upsert(session, WikiPage.__table__, [{'id': 5, 'revision_id': 1}])
+                session.commit()
+        self.assertEqual([1, 2, 3, 4, 6, 7], page_ids)
+
+    def test_category_cache(self):
+        session.add(Category(id=5, name='cat1'))
+        session.commit()
+
+        cache = CategoryCache(session)
+        ids = cache.get_ids(['cat2', 'cat1', 'cat2', 'cat3'])
+        session.commit()
+
+        self.assertEqual(5, ids[1])
+        self.assertEqual(ids[0], ids[2])
+        self.assertEqual({'cat1', 'cat2', 'cat3'}, {c.name for c in session.query(Category)})
+        self.assertEqual(ids, CategoryCache(session).get_ids(['cat2', 'cat1', 'cat2', 'cat3']))
+
+    def test_state(self):
+        self.assertIsNone(get_state(session, 'last_sync'))
+        set_state(session, 'last_sync', '2020-01-01T00:00:00Z')
+        set_state(session, 'last_sync', '2020-02-01T00:00:00Z')
+        session.commit()
+        self.assertEqual('2020-02-01T00:00:00Z', get_state(session, 'last_sync'))
+
+        set_state(session, 'last_sync', None)
+        session.commit()
+        self.assertIsNone(get_state(session, 'last_sync'))
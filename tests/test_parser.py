@@ -17,10 +17,23 @@ class TestParser(unittest.TestCase):
         source = '{{a {{{{c}} b}} }}hedge{{aa}}hog'
         self.assertEqual('hedgehog', Parser(source).remove_templates().content)
 
+    def test_remove_templates_unbalanced(self):
+        self.assertEqual('a}} b {{c ', Parser('a}} b {{c {{d}}').remove_templates().content)
+        self.assertEqual('}x', Parser('{{{a}}}x').remove_templates().content)
+        self.assertEqual('', Parser('{{x}{{a}}}').remove_templates().content)
+
     def test_get_first_paragraph(self):
         source = '{{template}} testContent \n\n==Next section header==\n:any content here'
         self.assertEqual('testContent', Parser(source).remove_templates().get_first_section().content)
 
+    def test_get_first_section_heading_first(self):
+        source = '==Heading==\ncontent'
+        self.assertEqual('', Parser(source).get_first_section().content)
+
+    def test_get_first_section_hidden_heading(self):
+        source = 'lead <!--\n==Commented==\n-->\nmore\n==Next==\nx'
+        self.assertEqual('lead <!--\n==Commented==\n-->\nmore', Parser(source).get_first_section().content)
+
     def test_replace_links(self):
         source = 'string [[test]][[x lol]]'
         self.assertEqual('string [test](#test)[x lol](#x-lol)', Parser(source).to_markdown().content)
@@ -29,6 +42,15 @@ class TestParser(unittest.TestCase):
         source = '[[test|bed]][[x lol|word another]] yy'
         self.assertEqual('[bed](#test)[word another](#x-lol) yy', Parser(source).to_markdown().content)
 
+    def test_emphasis(self):
+        source = "'''bold''' and ''italic'' and '''''both'''''"
+        self.assertEqual('**bold** and *italic* and ***both***', Parser(source).to_markdown().content)
+
     def test_remove_category_links(self):
         source = 'test [[link]]\n[[Category:Cat name]]'
         self.assertEqual('test [[link]]\n', Parser(source).remove_category_links().content)
+
+    def test_remove_category_links_case_whitespace(self):
+        source = 'test [[category:bastards]] [[ Category : Cat name | sort ]][[:Category:Shown]]'
+        self.assertEqual(['Bastards', 'Cat name'], Parser.category_names(source))
+        self.assertEqual('test  [[:Category:Shown]]', Parser(source).remove_category_links().content)
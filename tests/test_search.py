@@ -0,0 +1,45 @@
+from unittest import TestCase
+
+from wikidict.model import Base, WikiPage, upsert
+from wikidict.search import create_search_index, search, update_search_index, remove_from_search_index, \
+    search_index_exists
+
+from tests import session, engine
+
+
+class TestSearch(TestCase):
+
+    def setUp(self) -> None:
+        session.expunge_all()
+        session.execute('DROP TABLE IF EXISTS page_search')
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        upsert(session, WikiPage.__table__, [
+            {'id': 1, 'title': 'Jon Snow', 'redirect_title': None,
+             'content': "{{Infobox|name=Jon}}'''Jon Snow''' is a member of the [[Night's Watch|Watch]].\n"
+                        "== History ==\nBorn at Winterfell."},
+            {'id': 2, 'title': 'Lord Snow', 'redirect_title': 'Jon Snow', 'content': '#REDIRECT [[Jon Snow]]'},
+            {'id': 3, 'title': 'Ghost', 'redirect_title': None, 'content': "'''Ghost''' is Jon's direwolf."},
+        ])
+        session.commit()
+
+    def test_create_search_index(self):
+        self.assertFalse(search_index_exists(session))
+        self.assertTrue(create_search_index(session, batch_size=1))
+        self.assertFalse(create_search_index(session))
+
+        self.assertEqual([('Jon Snow', 'Jon Snow is a member of the [Watch].')], search(session, 'watch'))
+        self.assertEqual(['Jon Snow', 'Ghost'], [title for title, _ in search(session, 'jon')])
+        self.assertEqual([], search(session, 'winterfell'))
+        self.assertEqual(['Ghost'], [title for title, _ in search(session, 'dire*', raw=True)])
+
+    def test_update_search_index(self):
+        create_search_index(session)
+        update_search_index(session, [
+            {'id': 3, 'title': 'Ghost', 'redirect_title': 'Jon Snow', 'content': '#REDIRECT [[Jon Snow]]'},
+            {'id': 4, 'title': 'Nymeria', 'redirect_title': None, 'content': "Arya's direwolf."},
+        ])
+        self.assertEqual(['Nymeria'], [title for title, _ in search(session, 'direwolf')])
+
+        remove_from_search_index(session, titles=['Jon Snow'])
+        self.assertEqual([], search(session, 'jon snow'))
@@ -0,0 +1,46 @@
+import time
+from unittest import TestCase
+
+from wikidict.throttle import RateLimiter, backoff_delay
+
+
+class TestRateLimiter(TestCase):
+
+    def test_wait(self):
+        limiter = RateLimiter(max_per_second=20)
+        start = time.monotonic()
+        for _ in range(5):
+            limiter.wait()
+        self.assertGreaterEqual(time.monotonic() - start, 4 / 20)
+
+    def test_burst(self):
+        limiter = RateLimiter(max_per_second=1, burst=3)
+        start = time.monotonic()
+        for _ in range(3):
+            limiter.wait()
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertGreater(limiter.wait(), 0.5)
+
+    def test_pause(self):
+        limiter = RateLimiter()
+        limiter.pause(0.2)
+        start = time.monotonic()
+        limiter.wait()
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+        self.assertGreaterEqual(limiter.waited, 0.15)
+
+    def test_no_limit(self):
+        limiter = RateLimiter()
+        start = time.monotonic()
+        for _ in range(100):
+            limiter.wait()
+        self.assertLess(time.monotonic() - start, 0.1)
+
+
+class TestBackoff(TestCase):
+
+    def test_backoff_delay(self):
+        self.assertTrue(0.5 <= backoff_delay(0) <= 1)
+        self.assertTrue(4 <= backoff_delay(3) <= 8)
+        self.assertTrue(60 <= backoff_delay(10) <= 120)
+        self.assertEqual(30, backoff_delay(0, retry_after=30))
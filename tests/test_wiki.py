@@ -1,9 +1,13 @@
+from concurrent.futures import ThreadPoolExecutor
 from unittest import TestCase
+from unittest.mock import MagicMock, patch
 
+import requests
 from mediawiki import MediaWiki, MediaWikiException
 
-from wikidict.model import WikiPage, Base
-from wikidict.wiki import WikiDownloader
+from wikidict.dictionary import Dictionary
+from wikidict.model import WikiPage, Base, Category, RenderedEntry, get_state, set_state
+from wikidict.wiki import WikiDownloader, configure_http_session, MaxlagError, _raise_for_retry_status
 
 from tests import session, engine
 
@@ -27,6 +31,14 @@ class Test(TestCase):
              'A Clash of Kings-Chapter 12'},
             {p.title for p in session.query(WikiPage)})
 
+    def test_get_pages_with_revisions(self):
+        self.wiki_downloader.get_page_list(session, query_from='A Clash of Kings-Chapter 1', max_pages=4,
+                                           revisions=True)
+        pages = session.query(WikiPage).all()
+        self.assertLessEqual(4, len(pages))
+        for page in pages:
+            self.assertLess(1, page.latest_revision_online)
+
     def test_update_latest_revisions(self):
         page_ids = [2581, 14424, 2752]
         self.wiki_downloader.update_latest_revisions(session, page_ids=page_ids)
@@ -45,6 +57,24 @@ class Test(TestCase):
             page = session.query(WikiPage).get(page_id)
             self.assertTrue(len(page.content) > 0)
 
+    def test_update_pages_concurrent(self):
+        wiki_downloader = WikiDownloader(self.wiki_downloader.wiki, workers=3, max_requests_per_second=5)
+        page_titles = ['A Rose of Gold', 'A Thousand Eyes, and One', 'A World of Ice and Fire']
+        wiki_downloader.update_pages(session, page_titles=page_titles, follow_redirects=False)
+
+        self.assertEqual(set(page_titles), {p.title for p in session.query(WikiPage)})
+
+    def test_detect_limits(self):
+        wiki_downloader = WikiDownloader(self.wiki_downloader.wiki)
+        wiki_downloader.detect_limits()
+        self.assertLessEqual(50, wiki_downloader.max_batch_size)
+        self.assertLessEqual(500, wiki_downloader.max_list_size)
+
+        page_ids = [2581, 14424, 2752]
+        wiki_downloader.update_pages(session, page_ids=page_ids)
+        for page_id in page_ids:
+            self.assertTrue(len(session.query(WikiPage).get(page_id).content) > 0)
+
     def test_update_outdated_pages(self):
         page_ids = [2581, 14424, 2752]
 
@@ -57,6 +87,19 @@ class Test(TestCase):
             page = session.query(WikiPage).get(page_id)
             self.assertTrue(len(page.content) > 0)
 
+    def test_update_recent_changes(self):
+        self.assertFalse(self.wiki_downloader.update_recent_changes(session))
+
+        set_state(session, 'last_sync', self.wiki_downloader._server_timestamp())
+        session.commit()
+        self.assertTrue(self.wiki_downloader.update_recent_changes(session))
+
+    def test_update_page_index_sets_last_sync(self):
+        set_state(session, 'last_sync', self.wiki_downloader._server_timestamp())
+        session.commit()
+        self.wiki_downloader.update_page_index(session, incremental=True)
+        self.assertIsNotNone(get_state(session, 'last_sync'))
+
     def test__continued_response(self):
         iterator = self.wiki_downloader._continued_response(
             query_params={'action': 'blah'}, result_parse_func=lambda: None)
@@ -67,6 +110,17 @@ class Test(TestCase):
         self.wiki_downloader.update_pages(session, page_titles=['Abel'])
         self.assertIsNotNone(session.query(WikiPage).filter(WikiPage.title == 'Mance Rayder').first())
 
+    def test_update_pages_resolve_redirects(self):
+        self.wiki_downloader.update_latest_revisions(session, page_titles=['Abel'])
+        downloaded_ids = self.wiki_downloader.update_pages(session, page_titles=['Abel'], resolve_redirects=True)
+
+        target = session.query(WikiPage).filter(WikiPage.title == 'Mance Rayder').first()
+        source = session.query(WikiPage).filter(WikiPage.title == 'Abel').first()
+        self.assertEqual([target.id], downloaded_ids)
+        self.assertEqual(target.id, source.redirect_to_id)
+        self.assertIsNone(source.content)
+        self.assertEqual(source.latest_revision_online, source.revision_id)
+
     def test_link_redirects(self):
         self.wiki_downloader.update_pages(session, page_titles=['Abel', 'Aegon I'], follow_redirects=False)
         source_ids = []
@@ -111,3 +165,196 @@ class Test(TestCase):
 
         # 6. See that the page has been updated in database
         self.assertIsNone(session.query(WikiPage).filter(WikiPage.revision_id < WikiPage.latest_revision_online).first())
+
+
+class TestHttpSession(TestCase):
+
+    def test_configure_http_session(self):
+        http_session = requests.Session()
+        http_session.headers['User-Agent'] = 'test-agent'
+        http_session.proxies['https'] = 'http://proxy:3128'
+        http_session.verify = False
+        configure_http_session(http_session, pool_size=4)
+        configure_http_session(http_session, pool_size=4)
+
+        self.assertEqual('test-agent', http_session.headers['User-Agent'])
+        self.assertEqual({'https': 'http://proxy:3128'}, http_session.proxies)
+        self.assertFalse(http_session.verify)
+        self.assertIn('gzip', http_session.headers['Accept-Encoding'])
+        self.assertEqual(4, http_session.get_adapter('https://awoiaf.westeros.org/api.php')._pool_maxsize)
+        self.assertEqual(1, len(http_session.hooks['response']))
+
+
+class TestRetry(TestCase):
+
+    def setUp(self) -> None:
+        self.wiki = MagicMock()
+        self.wiki_downloader = WikiDownloader(self.wiki, max_retries=2, maxlag=5)
+
+    @patch('wikidict.wiki.backoff_delay', return_value=0)
+    def test_retry(self, _):
+        error_response = requests.Response()
+        error_response.status_code = 503
+        self.wiki.wiki_request.side_effect = [
+            requests.HTTPError(response=error_response),
+            {'error': {'code': 'maxlag', 'info': 'Waiting for db: 6 seconds lagged'}},
+            {'batchcomplete': ''},
+        ]
+        self.assertEqual({'batchcomplete': ''}, self.wiki_downloader._request({'list': 'allpages'}))
+        self.assertEqual(2, self.wiki_downloader.retries)
+        self.wiki.wiki_request.assert_called_with({'list': 'allpages', 'maxlag': 5})
+
+    @patch('wikidict.wiki.backoff_delay', return_value=0)
+    def test_retry_maxlag_header(self, backoff_delay):
+        maxlag_response = requests.Response()
+        maxlag_response.status_code = 200
+        maxlag_response.headers.update({'MediaWiki-API-Error': 'maxlag', 'Retry-After': '7', 'X-Database-Lag': '6'})
+        with self.assertRaises(MaxlagError) as context:
+            _raise_for_retry_status(maxlag_response)
+
+        self.wiki.wiki_request.side_effect = [context.exception, {'batchcomplete': ''}]
+        self.wiki_downloader._request({'list': 'allpages'})
+        backoff_delay.assert_called_once_with(0, 7.0)
+
+    @patch('wikidict.wiki.backoff_delay', return_value=0)
+    def test_retry_count_threads(self, _):
+        def fail_first(query_params):
+            if query_params['attempt'] == 0:
+                query_params['attempt'] += 1
+                raise requests.ConnectionError('refused')
+            return {'batchcomplete': ''}
+        self.wiki.wiki_request.side_effect = fail_first
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda _: self.wiki_downloader._request({'attempt': 0}), range(200)))
+        self.assertEqual(200, self.wiki_downloader.retries)
+
+    @patch('wikidict.wiki.backoff_delay', return_value=0)
+    def test_retry_exhausted(self, _):
+        self.wiki.wiki_request.side_effect = requests.ConnectionError('refused')
+        with self.assertRaises(MediaWikiException):
+            self.wiki_downloader._request({'list': 'allpages'})
+        self.assertEqual(3, self.wiki.wiki_request.call_count)
+
+    def test_no_retry_on_client_error(self):
+        error_response = requests.Response()
+        error_response.status_code = 404
+        self.wiki.wiki_request.side_effect = requests.HTTPError(response=error_response)
+        with self.assertRaises(requests.HTTPError):
+            self.wiki_downloader._request({'list': 'allpages'})
+
+
+class TestCheckpoint(TestCase):
+
+    def setUp(self) -> None:
+        session.expunge_all()
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        self.wiki = MagicMock()
+        self.wiki_downloader = WikiDownloader(self.wiki, max_retries=0)
+
+    @staticmethod
+    def _response(page_id, title, continue_from=None):
+        response = {'query': {'pages': {str(page_id): {
+            'pageid': page_id, 'title': title, 'revisions': [{'revid': 100 + page_id}]}}}}
+        if continue_from is not None:
+            response['continue'] = {'gapcontinue': continue_from, 'continue': 'gapcontinue||'}
+        return response
+
+    def test_resume_page_index(self):
+        self.wiki.wiki_request.side_effect = [
+            {'curtimestamp': '2020-01-01T00:00:00Z'},
+            self._response(1, 'A', continue_from='B'),
+            requests.ConnectionError('interrupted'),
+        ]
+        with self.assertRaises(MediaWikiException):
+            self.wiki_downloader.update_page_index(session)
+        self.assertEqual('page_list', get_state(session, 'sync_phase'))
+        self.assertIn('"gapcontinue": "B"', get_state(session, 'page_list_continue'))
+
+        self.wiki.wiki_request.side_effect = [self._response(2, 'B')]
+        self.wiki_downloader.update_page_index(session)
+        self.assertEqual('B', self.wiki.wiki_request.call_args[0][0]['gapcontinue'])
+        self.assertEqual([(1, 101), (2, 102)],
+                         session.query(WikiPage.id, WikiPage.latest_revision_online).order_by(WikiPage.id).all())
+        self.assertEqual('2020-01-01T00:00:00Z', get_state(session, 'last_sync'))
+        self.assertIsNone(get_state(session, 'sync_phase'))
+        self.assertIsNone(get_state(session, 'page_list_continue'))
+
+    def test_empty_page_list(self):
+        self.wiki.wiki_request.side_effect = [{'batchcomplete': ''}, {'batchcomplete': '', 'query': {'allpages': []}}]
+        self.wiki_downloader.get_page_list(session, query_from='Zzzz', revisions=True)
+        self.wiki_downloader.get_page_list(session, query_from='Zzzz')
+        self.assertEqual(0, session.query(WikiPage).count())
+        self.assertIsNone(get_state(session, 'page_list_continue'))
+
+
+class TestResolvedRedirects(TestCase):
+
+    def setUp(self) -> None:
+        session.expunge_all()
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+
+    def test_add_resolved_redirects(self):
+        session.add_all([WikiPage(id=1, title='Jon Snow', revision_id=10, latest_revision_online=10),
+                         WikiPage(id=2, title='Lord Snow'),
+                         WikiPage(id=3, title='Snow', latest_revision_online=30)])
+        session.commit()
+
+        WikiDownloader._add_resolved_redirects({'query': {'redirects': [
+            {'from': 'Lord Snow', 'to': 'Jon Snow'}, {'from': 'Snow', 'to': 'Jon Snow'}]}}, session)
+        session.commit()
+
+        self.assertEqual([(2, 0, 0, 1), (3, 30, 30, 1)], session.query(
+            WikiPage.id, WikiPage.revision_id, WikiPage.latest_revision_online, WikiPage.redirect_to_id)
+            .filter(WikiPage.id > 1).order_by(WikiPage.id).all())
+        self.assertEqual([], WikiDownloader._outdated_titles(session, ['Lord Snow', 'Snow']))
+
+    def test_add_resolved_redirect_missing_target(self):
+        session.add(WikiPage(id=1, title='Ghost', revision_id=10, latest_revision_online=11,
+                             content='Ghost is a [[direwolf]].', categories=[Category(name='Direwolves')]))
+        session.commit()
+        list(Dictionary(session).entries())
+        self.assertEqual(1, session.query(RenderedEntry).count())
+
+        WikiDownloader._add_resolved_redirects({'query': {'redirects': [{'from': 'Ghost', 'to': 'Nymeria'}]}},
+                                               session)
+        session.commit()
+        session.expunge_all()
+
+        ghost = session.query(WikiPage).get(1)
+        self.assertEqual((11, 11, None, 'Nymeria', '#REDIRECT [[Nymeria]]'), (
+            ghost.revision_id, ghost.latest_revision_online, ghost.redirect_to_id, ghost.redirect_title, ghost.content))
+        self.assertEqual([], ghost.categories)
+        self.assertEqual(0, session.query(RenderedEntry).count())
+        self.assertNotIn('direwolf', ''.join(e.format() for e in Dictionary(session).entries()))
+
+
+class TestRecentChanges(TestCase):
+
+    def setUp(self) -> None:
+        session.expunge_all()
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        self.wiki = MagicMock()
+        self.wiki_downloader = WikiDownloader(self.wiki)
+
+    def test_recreated_page(self):
+        session.add(WikiPage(id=1, title='Ghost', revision_id=10, latest_revision_online=10))
+        set_state(session, 'last_sync', '2020-01-01T00:00:00Z')
+        session.commit()
+        self.wiki.wiki_request.return_value = {'query': {'recentchanges': [
+            {'type': 'log', 'logtype': 'delete', 'logaction': 'delete', 'title': 'Ghost', 'pageid': 0},
+            {'type': 'new', 'title': 'Ghost', 'pageid': 2, 'revid': 20},
+        ]}}
+
+        self.assertTrue(self.wiki_downloader.update_recent_changes(session, now='2020-01-02T00:00:00Z'))
+        self.assertEqual([(2, 'Ghost', 20)],
+                         session.query(WikiPage.id, WikiPage.title, WikiPage.latest_revision_online).all())
+
+    def test_last_sync_too_old(self):
+        set_state(session, 'last_sync', '2020-01-01T00:00:00Z')
+        session.commit()
+        self.assertFalse(self.wiki_downloader.update_recent_changes(session, now='2020-03-01T00:00:00Z'))
+        self.wiki.wiki_request.assert_not_called()
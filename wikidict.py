@@ -1,11 +1,14 @@
 import argparse
 import logging
+import sys
 
 from mediawiki import MediaWiki
 
-from wikidict import delete_database, ensure_database, __version__, __user_agent__, get_session
+from wikidict import delete_database, ensure_database, __version__, __user_agent__, get_session, SQLITE_PROFILES
 from wikidict.dictionary import Dictionary
-from wikidict.wiki import WikiDownloader
+from wikidict.dump import DumpImporter
+from wikidict.search import create_search_index, search, search_index_exists
+from wikidict.wiki import WikiDownloader, configure_wiki_session
 
 logger = logging.getLogger(__name__)
 
@@ -21,19 +24,53 @@ def main():
                         default='https://awoiaf.westeros.org/api.php')
     parser.add_argument('-x', '--user-agent', help='Custom user agent', default=__user_agent__)
 
+    parser.add_argument('--import-dump', help='Import pages from MediaWiki XML dump file (.xml or .xml.bz2) '
+                                              'before downloading', metavar='FILE', default=None)
     parser.add_argument('-d', '--download', help='Download articles with outdated version',
                         action='store_true')
+    parser.add_argument('-i', '--incremental', help='With --download, update page list from recent changes '
+                                                    'since last download', default=False, action='store_true')
+    parser.add_argument('--download-workers', help='Number of concurrent download requests (default: 1)',
+                        type=int, default=1)
+    parser.add_argument('--http-pool-size', help='Number of HTTP connections to keep open '
+                                                 '(default: number of download workers)', type=int, default=None)
+    parser.add_argument('--max-request-rate', help='Maximum API requests per second (default: no limit)',
+                        type=float, default=None)
+    parser.add_argument('--max-retries', help='Number of times to retry failed API requests (default: 5)',
+                        type=int, default=5)
+    parser.add_argument('--maxlag', help='Ask the wiki to refuse requests when its database replication lag is over '
+                                         'this many seconds, and retry later (default: not sent)',
+                        type=int, default=None)
+    parser.add_argument('-j', '--jobs', help='Number of processes for rendering dictionary entries (default: 1)',
+                        type=int, default=1)
+    parser.add_argument('--no-cache', help='Render all entries, do not use or update rendered entry cache',
+                        default=False, action='store_true')
+    parser.add_argument('--resolve-redirects', help='Let the wiki resolve redirects instead of downloading '
+                                                    'redirect pages', default=False, action='store_true')
+    parser.add_argument('--sqlite-profile', choices=sorted(SQLITE_PROFILES),
+                        help='SQLite tuning profile (default: bulk when downloading or importing, else default)')
+    parser.add_argument('--search-index', help='Create full-text search index of pages, if it does not exist. '
+                                               'Existing index is updated with downloaded pages.',
+                        default=False, action='store_true')
     parser.add_argument('-v', '--version', help='Display version and exit', action='store_true')
     parser.add_argument('--rebuild', help='Discard existing database',
                         default=False, action='store_true')
 
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    search_parser = subparsers.add_parser('search', help='Search pages in database, instead of saving dictionary')
+    search_parser.add_argument('query', help='Search terms', nargs='+')
+    search_parser.add_argument('-n', '--limit', help='Maximum number of results (default: 20)', type=int, default=20)
+    search_parser.add_argument('--raw', help='Query is in SQLite FTS5 query syntax', default=False,
+                               action='store_true')
+
     args = parser.parse_args()
 
     logging.basicConfig(level=args.log_level)
 
     logger.info(args)
 
-    session = get_session(args.api_url)
+    session = get_session(args.api_url, profile=args.sqlite_profile or (
+        'bulk' if args.download or args.import_dump is not None else 'default'))
 
     if args.version:
         print(__version__)
@@ -43,15 +80,33 @@ def main():
         delete_database(session)
     ensure_database(session)
 
-    wiki = MediaWiki(url=args.api_url, user_agent=args.user_agent)
-    wiki_downloader = WikiDownloader(wiki)
+    if args.command == 'search':
+        if not search_index_exists(session):
+            sys.exit('Search index does not exist, create it with --search-index')
+        for title, snippet in search(session, ' '.join(args.query), limit=args.limit, raw=args.raw):
+            print('{}\n    {}'.format(title, snippet.replace('\n', ' ')))
+        return
 
-    if args.download:
-        wiki_downloader.get_page_list(session)
-        wiki_downloader.update_latest_revisions(session)
-        wiki_downloader.update_outdated_pages(session)
+    if args.import_dump is not None:
+        DumpImporter().import_dump(session, args.import_dump)
 
-    dictionary = Dictionary(session)
+    if args.download:
+        wiki = MediaWiki(url=args.api_url, user_agent=args.user_agent)
+        configure_wiki_session(wiki, pool_size=args.http_pool_size or args.download_workers)
+        wiki_downloader = WikiDownloader(wiki, workers=args.download_workers,
+                                         max_requests_per_second=args.max_request_rate,
+                                         max_retries=args.max_retries, maxlag=args.maxlag)
+        wiki_downloader.detect_limits()
+        wiki_downloader.update_page_index(session, incremental=args.incremental)
+        wiki_downloader.update_outdated_pages(session, resolve_redirects=args.resolve_redirects)
+        wiki_downloader.link_redirects(session)
+        logger.info('Requests throttled for {:.1f} s in total, {} retries'.format(
+            wiki_downloader.rate_limiter.waited, wiki_downloader.retries))
+
+    if args.search_index:
+        create_search_index(session)
+
+    dictionary = Dictionary(session, use_cache=not args.no_cache, jobs=args.jobs)
     dictionary.save(args.output)
 
 
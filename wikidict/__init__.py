@@ -1,13 +1,15 @@
+import logging
 import os
 from urllib.parse import urlparse
 
 import sqlalchemy.engine.url
 from mediawiki import mediawiki
-from sqlalchemy import create_engine, event
+from sqlalchemy import create_engine, event, inspect, text, bindparam, type_coerce, Text
 from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
 
-from wikidict.model import Base
+from wikidict.model import Base, WikiPage, SyncState
+from wikidict.parser import Parser
 
 __version__ = '0.0.0'
 __user_agent__ = 'wikidict/{} (https://github.com/mkouhia/wikidict; mkouhia@iki.fi) ' \
@@ -15,14 +17,69 @@ __user_agent__ = 'wikidict/{} (https://github.com/mkouhia/wikidict; mkouhia@iki.
 
 Session = sessionmaker()
 
-
-def get_session(api_url) -> Session:
+# Page content storage format, recorded as sync state 'content_format'. Version suffix identifies
+# the preset dictionary, model.CONTENT_DICTIONARY: databases marked with another format are migrated.
+CONTENT_FORMAT = 'zlib-dict-1'
+
+logger = logging.getLogger(__name__)
+
+# SQLite pragmas set on each new connection, see https://www.sqlite.org/pragma.html
+SQLITE_PROFILES = {
+    # Write-ahead log: readers do not block writer, and commits need no fsync of the main database file.
+    # With synchronous=NORMAL, a power loss may roll back latest commits, but does not corrupt the database.
+    'default': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -64 * 1024,  # negative: KiB
+        'temp_store': 'MEMORY',
+        'mmap_size': 256 * 1024 ** 2,
+    },
+    # Downloads and dump imports: no fsync at all. An operating system crash or power loss may corrupt the
+    # database, an application crash does not.
+    'bulk': {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -256 * 1024,
+        'temp_store': 'MEMORY',
+        'mmap_size': 1024 ** 3,
+    },
+    # SQLite defaults, e.g. for databases on network file systems, where WAL does not work
+    'compatible': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+    },
+}
+
+
+def get_session(api_url, profile: str = 'default') -> Session:
+    """Get session for SQLite database of the wiki, in working directory
+
+    :param api_url: wiki API url, database is named by its host
+    :param profile: SQLite tuning profile name in SQLITE_PROFILES
+    """
     db_path = '{}.db'.format(urlparse(api_url).netloc)
     engine = create_engine(sqlalchemy.engine.url.URL(drivername='sqlite', database=db_path))
+    set_sqlite_profile(engine, profile)
     Session.configure(bind=engine)
     return Session()
 
 
+def set_sqlite_profile(engine: Engine, profile: str) -> None:
+    """Set pragmas of SQLite tuning profile on each new connection of engine
+
+    :param engine: SQLite database engine
+    :param profile: profile name in SQLITE_PROFILES
+    """
+    pragmas = SQLITE_PROFILES[profile]
+
+    @event.listens_for(engine, 'connect')
+    def set_profile_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA {}={}'.format(name, value))
+        cursor.close()
+
+
 @event.listens_for(Engine, 'connect')
 def set_sqlite_pragma(dbapi_connection, connection_record):
     """Set pragma foreign_keys=ON for SQLite database"""
@@ -32,16 +89,102 @@ def set_sqlite_pragma(dbapi_connection, connection_record):
 
 
 def ensure_database(session: Session):
-    """Make sure that SQLite database and tables exist"""
+    """Make sure that SQLite database and tables exist, and that existing database is up to date"""
     engine = session.get_bind()
     if not sqlite_file_exists(engine.url.database):
         Base.metadata.create_all(engine)
+        _set_content_format(engine)
+    else:
+        migrate_database(engine)
+
+
+def migrate_database(engine: Engine):
+    """Update database created by an earlier version: add missing tables, columns and indexes"""
+    Base.metadata.create_all(engine)
+
+    inspector = inspect(engine)
+    added_columns = []
+    for table in Base.metadata.sorted_tables:
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                logger.info('Add column {}.{}'.format(table.name, column.name))
+                engine.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    table.name, column.name, column.type.compile(engine.dialect)))
+                added_columns.append(column)
+
+    if WikiPage.__table__.c.redirect_title in added_columns:
+        _set_redirect_titles(engine)
+
+    for table in Base.metadata.sorted_tables:
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                logger.info('Create index {}'.format(index.name))
+                index.create(engine)
+
+    content_format = engine.execute(
+        SyncState.__table__.select().with_only_columns([SyncState.value]).where(SyncState.name == 'content_format')
+    ).scalar()
+    if content_format != CONTENT_FORMAT:
+        _compress_content(engine)
+
+
+def _set_redirect_titles(engine: Engine):
+    """Set redirect_title of existing pages from their content"""
+    pages = WikiPage.__table__
+    with engine.begin() as connection:
+        redirects = []
+        for page_id, content in connection.execute(
+                pages.select().with_only_columns([pages.c.id, pages.c.content])
+                .where(type_coerce(pages.c.content, Text).like('#REDIRECT%'))):
+            redirect_title = Parser.redirect_target(content)
+            if redirect_title is not None:
+                redirects.append({'page_id': page_id, 'redirect_title': redirect_title})
+        if len(redirects) > 0:
+            connection.execute(text('UPDATE pages SET redirect_title = :redirect_title WHERE id = :page_id'),
+                               redirects)
+
+
+def _compress_content(engine: Engine, batch_size: int = 1000):
+    """Compress page content stored as text by earlier versions, and reclaim free space with VACUUM"""
+    select_text = text("SELECT id, content FROM pages WHERE typeof(content) = 'text' LIMIT :limit")
+    update = text('UPDATE pages SET content = :content WHERE id = :page_id') \
+        .bindparams(bindparam('content', type_=WikiPage.__table__.c.content.type))
+    n_pages = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(select_text, limit=batch_size).fetchall()
+            if len(rows) == 0:
+                break
+            connection.execute(update, [{'page_id': page_id, 'content': content} for page_id, content in rows])
+        n_pages += len(rows)
+        logger.debug('Compressed content of {} pages'.format(n_pages))
+
+    _set_content_format(engine)
+    if n_pages > 0:
+        logger.info('Compressed content of {} pages, vacuum database'.format(n_pages))
+        engine.execute('VACUUM')
+
+
+def _set_content_format(engine: Engine):
+    with engine.begin() as connection:
+        connection.execute(text('INSERT OR REPLACE INTO sync_state (name, value) VALUES (:name, :value)'),
+                           name='content_format', value=CONTENT_FORMAT)
 
 
 def delete_database(session: Session):
+    """Delete SQLite database file, with its write-ahead log and shared memory files"""
     engine = session.get_bind()
+    session.close()
+    engine.dispose()
     if sqlite_file_exists(engine.url.database):
         os.remove(engine.url.database)
+    for suffix in ('-wal', '-shm'):
+        try:
+            os.remove(engine.url.database + suffix)
+        except FileNotFoundError:
+            pass
 
 
 def sqlite_file_exists(db_file_name):
@@ -3,21 +3,44 @@ from __future__ import annotations
 import contextlib
 import logging
 import sys
-from typing import List
+from collections import defaultdict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import List, Iterator, Any, Optional
 
+from sqlalchemy import or_, and_, literal_column
 from sqlalchemy.orm import Session
 
-from wikidict.model import WikiPage
+from wikidict.model import WikiPage, Category, RenderedEntry, category_association, upsert
 from wikidict.parser import Parser
 
 
 logger = logging.getLogger(__name__)
 
+# Version of rendered entry bodies; increment when rendering output changes, to invalidate cached bodies
+BODY_FORMAT_VERSION = 2
+
+
+def render_kobo_body(content: str) -> str:
+    """Render kobo dictionary entry body from MediaWiki wikitext"""
+    return "" if content is None else Parser(content)\
+        .remove_templates()\
+        .get_first_section()\
+        .remove_category_links()\
+        .to_markdown()\
+        .content
+
 
 class Dictionary(object):
 
-    def __init__(self, session: Session):
+    def __init__(self, session: Session, use_cache: bool = True, jobs: int = 1):
+        """
+        :param session: sql database session
+        :param use_cache: use and update rendered entry bodies stored in database
+        :param jobs: number of processes for rendering entries
+        """
         self.session = session
+        self.use_cache = use_cache
+        self.jobs = jobs
 
     def save(self, file_path: str = None, dict_format='kobo'):
         """Save wiki dictionary as text file
@@ -25,13 +48,103 @@ class Dictionary(object):
         :param dict_format: dictionary format. Allowed values: 'kobo'
         """
         logger.info('Writing output file')
-        pages = self.session.query(WikiPage) \
-            .filter(WikiPage.redirect_to_id == None).order_by('title')  # noqa: E711
-
         with self._smart_open(file_path) as f:
-            page: WikiPage
-            for page in pages:
-                f.write(DictEntry.from_wikipage(page).format(dict_format))
+            for entry in self.entries():
+                f.write(entry.format(dict_format))
+
+    def entries(self, batch_size: int = 500) -> Iterator[DictEntry]:
+        """Iterate dictionary entries of non-redirect pages, ordered by title
+
+        Pages are loaded in batches of plain columns, paginated by (title, id). Categories and
+        redirect titles are loaded with one query per batch, so that memory use stays constant.
+
+        Entry bodies are rendered for each batch, in `jobs` processes if more than one. If cache is used,
+        content is loaded and rendered only for pages without a cached body for their current revision,
+        and rendered bodies are committed to the cache after each batch.
+
+        :param batch_size: number of pages to load per batch
+        """
+        query = self.session.query(WikiPage.id, WikiPage.title, WikiPage.revision_id) \
+            .filter(WikiPage.redirect_to_id == None) \
+            .order_by(WikiPage.title, WikiPage.id)  # noqa: E711
+        if self.use_cache:
+            query = query.outerjoin(RenderedEntry, and_(
+                RenderedEntry.page_id == WikiPage.id,
+                RenderedEntry.revision_id == WikiPage.revision_id,
+                RenderedEntry.format_version == BODY_FORMAT_VERSION)).add_columns(RenderedEntry.body)
+
+        executor = ProcessPoolExecutor(max_workers=self.jobs) if self.jobs > 1 else None
+        try:
+            last_title, last_id = None, None
+            while True:
+                batch_query = query
+                if last_id is not None:
+                    # NULL titles sort first in SQLite
+                    batch_query = batch_query.filter(or_(
+                        WikiPage.title != None if last_title is None else WikiPage.title > last_title,  # noqa: E711
+                        and_(WikiPage.title == last_title, WikiPage.id > last_id)))
+                pages = batch_query.limit(batch_size).all()
+                if len(pages) == 0:
+                    return
+
+                page_ids = [page.id for page in pages]
+
+                # First category is written to the entry: keep links in insertion order
+                categories = defaultdict(list)
+                for page_id, name in self.session.query(category_association.c.page_id, Category.name) \
+                        .join(Category, Category.id == category_association.c.category_id) \
+                        .filter(category_association.c.page_id.in_(page_ids)) \
+                        .order_by(literal_column('category_association.rowid')):
+                    categories[page_id].append(name)
+
+                variants = defaultdict(list)
+                for target_id, title in self.session.query(WikiPage.redirect_to_id, WikiPage.title) \
+                        .filter(WikiPage.redirect_to_id.in_(page_ids)):
+                    variants[target_id].append(title)
+
+                bodies = {page.id: page.body for page in pages if page.body is not None} if self.use_cache else {}
+                contents = dict(self.session.query(WikiPage.id, WikiPage.content)
+                                .filter(WikiPage.id.in_([i for i in page_ids if i not in bodies])))
+
+                entries = [DictEntry(title=page.title, content=contents.get(page.id), categories=categories[page.id],
+                                     variants=variants[page.id], body=bodies.get(page.id))
+                           for page in pages]
+                self._render(pages, entries, executor)
+
+                yield from entries
+
+                last_title, last_id = pages[-1].title, pages[-1].id
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def _render(self, pages: List[Any], entries: List[DictEntry], executor: Optional[Executor]) -> None:
+        """Render missing entry bodies, store those with known revision to cache and commit
+
+        :param pages: page rows, with id and revision_id
+        :param entries: dictionary entries of the pages
+        :param executor: render in this executor; None: render in this process
+        """
+        missing = [(page, entry) for page, entry in zip(pages, entries) if entry.body is None]
+        if len(missing) == 0:
+            return
+
+        contents = [entry.content for _, entry in missing]
+        if executor is None:
+            bodies = map(render_kobo_body, contents)
+        else:
+            bodies = executor.map(render_kobo_body, contents, chunksize=max(1, len(contents) // (4 * self.jobs)))
+
+        rows = []
+        for (page, entry), body in zip(missing, bodies):
+            entry.body = body
+            if page.revision_id is not None:
+                rows.append({'page_id': page.id, 'revision_id': page.revision_id,
+                             'format_version': BODY_FORMAT_VERSION, 'body': body})
+
+        if self.use_cache:
+            upsert(self.session, RenderedEntry.__table__, rows)
+            self.session.commit()
 
     @staticmethod
     @contextlib.contextmanager
@@ -50,11 +163,16 @@ class Dictionary(object):
 
 class DictEntry(object):
 
-    def __init__(self, title: str, content: str = "", categories: List[str] = None, variants: List[str] = None):
+    def __init__(self, title: str, content: str = "", categories: List[str] = None, variants: List[str] = None,
+                 body: str = None):
+        """
+        :param body: rendered kobo entry body; None: render from content when needed
+        """
         self.title = title
         self.content = content
         self.categories = categories
         self.variants = variants
+        self.body = body
 
     def format(self, dict_format='kobo') -> str:
         """Format dictionary entry to a string
@@ -65,13 +183,14 @@ class DictEntry(object):
         else:
             raise ValueError('Unknown dictionary format: {}'.format(dict_format))
 
+    def kobo_body(self) -> str:
+        """Get kobo entry body, render from content if not yet rendered"""
+        if self.body is None:
+            self.body = render_kobo_body(self.content)
+        return self.body
+
     def _format_kobo(self):
-        body = "" if self.content is None else Parser(self.content)\
-                   .remove_templates()\
-                   .get_first_section()\
-                   .remove_category_links()\
-                   .to_markdown()\
-                   .content
+        body = self.kobo_body()
         s = "@ {}\n".format(self.title)
         if len(self.categories) > 0:
             s += ": {}\n".format(self.categories[0])
@@ -0,0 +1,136 @@
+import bz2
+import logging
+import xml.etree.ElementTree as ElementTree
+from typing import Dict, IO, Iterator, List, Optional
+
+from sqlalchemy.orm import Session
+
+from wikidict.model import WikiPage, CategoryCache, upsert, replace_category_links
+from wikidict.parser import Parser
+from wikidict.search import update_search_index
+from wikidict.wiki import WikiDownloader
+
+logger = logging.getLogger(__name__)
+
+
+class DumpImporter(object):
+    """Import pages from MediaWiki XML dump, e.g. pages-articles.xml or pages-articles.xml.bz2
+
+    The dump is parsed as a stream, and pages are stored in batches, so that memory use does not
+    depend on dump size. Only pages in the main namespace are imported, with the last revision in
+    the dump. Pages stored with the same or a newer revision are not changed, so that importing an
+    older dump does not roll back pages. Categories are read from category links in page content.
+    """
+
+    def __init__(self, batch_size: int = 500):
+        """
+        :param batch_size: number of pages to store and commit at once
+        """
+        self.batch_size = batch_size
+
+    def import_dump(self, session: Session, file_path: str) -> int:
+        """Import pages from dump file to database, link redirects, and commit
+
+        :param session: sql database session
+        :param file_path: path to dump, compressed with bzip2 if the name ends with '.bz2'
+        :return: number of imported pages, not counting pages skipped for older revision
+        """
+        logger.info('Import pages from dump {}'.format(file_path))
+        categories = CategoryCache(session)
+        n_pages = 0
+        batch = []
+        with self._open(file_path) as f:
+            for page in self.iter_pages(f):
+                batch.append(page)
+                if len(batch) >= self.batch_size:
+                    n_pages += self._store(session, batch, categories)
+                    batch = []
+            n_pages += self._store(session, batch, categories)
+
+        WikiDownloader.link_redirects(session)
+        logger.info('Imported {} pages'.format(n_pages))
+        return n_pages
+
+    @staticmethod
+    def _open(file_path: str) -> IO:
+        return bz2.open(file_path, 'rb') if file_path.endswith('.bz2') else open(file_path, 'rb')
+
+    @staticmethod
+    def iter_pages(f: IO) -> Iterator[Dict]:
+        """Parse main namespace pages from dump XML
+
+        Parsed elements are cleared after each page, and removed from the document root.
+
+        :param f: dump file object
+        :return: iterator of dicts with keys id, title, revision_id, content and redirect_title
+        """
+        root = None
+        for event, elem in ElementTree.iterparse(f, events=('start', 'end')):
+            if root is None:
+                root = elem
+            if event == 'end' and _local_name(elem.tag) == 'page':
+                page = _parse_page(elem)
+                root.clear()
+                if page is not None:
+                    yield page
+
+    @staticmethod
+    def _store(session: Session, pages: List[Dict], categories: CategoryCache) -> int:
+        """Upsert pages, replace their category links and search index entries, commit
+
+        Pages are skipped, if database has the same or a newer revision. Latest online revision, e.g.
+        from page index, is kept if it is newer than the dump revision, so the page remains outdated.
+
+        :return: number of stored pages
+        """
+        stored = {page_id: (revision_id, latest_revision_online) for page_id, revision_id, latest_revision_online
+                  in session.query(WikiPage.id, WikiPage.revision_id, WikiPage.latest_revision_online)
+                  .filter(WikiPage.id.in_([page['id'] for page in pages]))}
+        no_revision = (None, None)
+        pages = [page for page in pages
+                 if stored.get(page['id'], no_revision)[0] is None or page['revision_id'] > stored[page['id']][0]]
+
+        rows = []
+        category_links = []
+        for page in pages:
+            latest_stored = stored.get(page['id'], no_revision)[1] or 0
+            row = dict(page, latest_revision_online=max(page['revision_id'], latest_stored))
+            if row['redirect_title'] is None:
+                row['redirect_to_id'] = None
+            rows.append(row)
+            category_links.extend((page['id'], name) for name in Parser.category_names(page['content']))
+
+        upsert(session, WikiPage.__table__, rows,
+               where='pages.revision_id IS NULL OR excluded.revision_id > pages.revision_id')
+        replace_category_links(session, [page['id'] for page in pages], category_links, categories)
+        update_search_index(session, rows)
+        session.commit()
+        return len(pages)
+
+
+def _local_name(tag: str) -> str:
+    """Strip XML namespace from element tag"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def _children(elem: ElementTree.Element) -> Dict[str, ElementTree.Element]:
+    """Child elements by local name; last element wins for repeated names"""
+    return {_local_name(child.tag): child for child in elem}
+
+
+def _parse_page(elem: ElementTree.Element) -> Optional[Dict]:
+    """Parse page element, or return None if page is not in main namespace or has no revision"""
+    page = _children(elem)
+    if page['ns'].text != '0' or 'revision' not in page:
+        return None
+
+    revision = _children(page['revision'])
+    content = (revision['text'].text if 'text' in revision else None) or ''
+    redirect_title = page['redirect'].get('title') if 'redirect' in page else Parser.redirect_target(content)
+    return {
+        'id': int(page['id'].text),
+        'title': page['title'].text,
+        'revision_id': int(revision['id'].text),
+        'content': content,
+        'redirect_title': redirect_title,
+    }
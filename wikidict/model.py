@@ -1,15 +1,51 @@
-from typing import Any
+import zlib
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, Table
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, Table, text, bindparam
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, backref, Session
+from sqlalchemy.orm import relationship, backref, deferred, Session
+from sqlalchemy.types import TypeDecorator
+
+# Preset dictionary for compressing wikitext: frequent markup, most common last, see zlib.compressobj.
+# These bytes must never change: stored content can only be decompressed with the exact same dictionary.
+# Improving it requires a new dictionary next to this one and a new wikidict.CONTENT_FORMAT version.
+CONTENT_DICTIONARY = (
+    '<references /> {{Reflist}} == See also == == References == == Notes == == External links == '
+    '{{Infobox | image = | caption = | name = | title = | date = | born = | died = | culture = | religion = '
+    '| allegiance = | father = | mother = | spouse = | issue = | house = | region = | location = | type = '
+    '<ref name= /> <ref>{{Ref|</ref> {{Ref|}}</ref> {{cite }} {{Main|}} [[File: |thumb|right| '
+    '#REDIRECT [[ [[Category: ]] == === ==\n\n === \n\n \'\'\' \'\' of the [[House ]] and the ]] [['
+).encode('utf-8')
+
+
+class CompressedText(TypeDecorator):
+    """Text stored as zlib compressed BLOB, with preset dictionary CONTENT_DICTIONARY
+
+    Values are decompressed when result rows are fetched. Uncompressed text values, e.g. of databases
+    created by earlier versions, are returned as they are.
+    """
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        compressor = zlib.compressobj(zdict=CONTENT_DICTIONARY)
+        return compressor.compress(value.encode('utf-8')) + compressor.flush()
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        decompressor = zlib.decompressobj(zdict=CONTENT_DICTIONARY)
+        return (decompressor.decompress(value) + decompressor.flush()).decode('utf-8')
 
 
 Base = declarative_base()
 
 category_association = Table('category_association', Base.metadata,
-                             Column('page_id', Integer, ForeignKey('pages.id')),
-                             Column('category_id', Integer, ForeignKey('categories.id'))
+                             Column('page_id', Integer, ForeignKey('pages.id'), index=True),
+                             Column('category_id', Integer, ForeignKey('categories.id'), index=True)
                              )
 
 
@@ -18,9 +54,10 @@ class WikiPage(Base):
     id = Column(Integer, primary_key=True)
     revision_id = Column(Integer)
     latest_revision_online = Column(Integer)
-    content = Column(Text)
-    title = Column(String(64))
-    redirect_to_id = Column(Integer, ForeignKey('pages.id'))
+    content = deferred(Column(CompressedText))  # loaded on first access, or with undefer()
+    title = Column(String(64), index=True)
+    redirect_to_id = Column(Integer, ForeignKey('pages.id'), index=True)
+    redirect_title = Column(String(64))
     redirect_from = relationship('WikiPage', backref=backref('redirect_to', remote_side=[id]))
     categories = relationship('Category', secondary=category_association, backref='pages')
 
@@ -60,3 +97,145 @@ def get_or_create(session: Session, model: Base, **kwargs: Any) -> Any:
             instance = model(**kwargs)
             session.add(instance)
             return instance
+
+
+class RenderedEntry(Base):
+    """Rendered dictionary entry body of a page revision"""
+    __tablename__ = 'rendered_entries'
+    page_id = Column(Integer, ForeignKey('pages.id'), primary_key=True)
+    revision_id = Column(Integer)
+    format_version = Column(Integer)
+    body = Column(Text)
+
+
+class SyncState(Base):
+    """Named value of wiki synchronization state, e.g. time of last sync"""
+    __tablename__ = 'sync_state'
+    name = Column(String(64), primary_key=True)
+    value = Column(Text)
+
+
+class CategoryCache(object):
+    """Category name -> ID mapping for a database session
+
+    Preload all categories on creation, and insert new categories in bulk, so that
+    ingesting pages needs no per-category queries.
+    """
+
+    def __init__(self, session: Session):
+        """
+        :param session: sql database session
+        """
+        self.session = session
+        self._ids: Dict[str, int] = {name: category_id for category_id, name
+                                     in session.query(Category.id, Category.name)}
+
+    def get_ids(self, names: Iterable[str]) -> List[int]:
+        """Get category IDs by name, create missing categories. Do not commit.
+
+        :param names: category names
+        :return: category IDs, in the order of names
+        """
+        names = list(names)
+        missing = list({name for name in names if name not in self._ids})
+        if len(missing) > 0:
+            self.session.execute(Category.__table__.insert(), [{'name': name} for name in missing])
+            for i in range(0, len(missing), 500):
+                self._ids.update(
+                    (name, category_id) for category_id, name
+                    in self.session.query(Category.id, Category.name).filter(Category.name.in_(missing[i:i + 500])))
+        return [self._ids[name] for name in names]
+
+
+def iter_page_ids(session: Session, *criteria, batch_size: int = 1000) -> Iterator[int]:
+    """Iterate page IDs in ascending order, querying in batches by keyset pagination on ID
+
+    Each batch is fetched completely before yielding, so that the session may commit during iteration,
+    and memory use does not depend on table size. Criteria are evaluated again for each batch: pages
+    that stop matching are not returned, and pages that start matching are returned if their ID is
+    not yet passed.
+
+    :param session: sql database session
+    :param criteria: filter criteria, e.g. WikiPage.revision_id == None
+    :param batch_size: number of IDs to query at once
+    """
+    last_id = None
+    while True:
+        query = session.query(WikiPage.id).filter(*criteria)
+        if last_id is not None:
+            query = query.filter(WikiPage.id > last_id)
+        page_ids = [page_id for (page_id,) in query.order_by(WikiPage.id).limit(batch_size)]
+        if len(page_ids) == 0:
+            return
+        yield from page_ids
+        last_id = page_ids[-1]
+
+
+def get_state(session: Session, name: str) -> Optional[str]:
+    """Get synchronization state value
+
+    :param session: sql database session
+    :param name: state name
+    :return: state value, or None if not set
+    """
+    state = session.query(SyncState).get(name)
+    return None if state is None else state.value
+
+
+def set_state(session: Session, name: str, value: Optional[str]) -> None:
+    """Set synchronization state value, do not commit
+
+    :param session: sql database session
+    :param name: state name
+    :param value: state value; None: remove state
+    """
+    if value is None:
+        session.query(SyncState).filter(SyncState.name == name).delete()
+    else:
+        session.merge(SyncState(name=name, value=value))
+
+
+def upsert(session: Session, table: Table, rows: Iterable[Dict[str, Any]], where: str = None) -> None:
+    """Insert rows to table, or update existing rows with the same primary key
+
+    Use SQLite INSERT ... ON CONFLICT DO UPDATE, with one executemany for each distinct set of row keys.
+    Only columns present in a row are updated. Values are bound with column types, e.g. compressed. Do not commit.
+
+    :param session: sql database session
+    :param table: database table, e.g. WikiPage.__table__
+    :param rows: dicts of column name -> value, each containing the primary key columns
+    :param where: SQL condition for updating an existing row, e.g. 'excluded.revision_id > pages.revision_id'
+    """
+    groups = defaultdict(list)
+    for row in rows:
+        groups[tuple(sorted(row))].append(row)
+
+    keys = [c.name for c in table.primary_key]
+    for columns, group in groups.items():
+        updates = [c for c in columns if c not in keys]
+        action = 'UPDATE SET ' + ', '.join('{0} = excluded.{0}'.format(c) for c in updates) if updates else 'NOTHING'
+        if updates and where is not None:
+            action += ' WHERE ' + where
+        statement = 'INSERT INTO {} ({}) VALUES ({}) ON CONFLICT ({}) DO {}'.format(
+            table.name, ', '.join(columns), ', '.join(':' + c for c in columns), ', '.join(keys), action)
+        session.execute(text(statement).bindparams(*(bindparam(c, type_=table.c[c].type) for c in columns)), group)
+
+
+def replace_category_links(session: Session, page_ids: List[int], links: List[Tuple[int, str]],
+                           categories: CategoryCache = None) -> None:
+    """Replace category links of pages, do not commit
+
+    :param session: sql database session
+    :param page_ids: pages whose existing category links are removed
+    :param links: new (page ID, category name) links
+    :param categories: category cache of the session; None: load new cache
+    """
+    if len(page_ids) > 0:
+        session.execute(category_association.delete().where(category_association.c.page_id.in_(page_ids)))
+    if len(links) > 0:
+        if categories is None:
+            categories = CategoryCache(session)
+        category_ids = categories.get_ids(name for _, name in links)
+        session.execute(category_association.insert(),
+                        [{'page_id': page_id, 'category_id': category_id}
+                         for (page_id, _), category_id in zip(links, category_ids)])
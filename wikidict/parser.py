@@ -1,13 +1,24 @@
 from __future__ import annotations
 
 import re
+from typing import List, Optional
 
 import mwparserfromhell
+from mwparserfromhell.nodes import Heading
+from mwparserfromhell.wikicode import Wikicode
 
 
 class Parser(object):
-    template_start_delimiter = '{{'
-    template_stop_delimiter = '}}'
+    _template_tokens = re.compile('[{}]|[^{}]+')
+    _link_pattern = re.compile('\\[\\[([^|\\]]+)(?:\\|([^\\]]+))?\\]\\]')
+    _emphasis_pattern = re.compile("'''|''")
+    _emphasis_markdown = {"'''": '**', "''": '*'}
+    _heading_candidate = re.compile('^=.*$', re.MULTILINE)
+    _unclosed_markup = re.compile("<|\\{|\\[\\[|''")
+    _lead_max_candidates = 3
+    _redirect_pattern = re.compile('#REDIRECT \\[\\[([^\\]]+)\\]\\].*')
+    _category_link_pattern = re.compile('\\[\\[\\s*Category\\s*:\\s*([^|\\]]+?)\\s*(?:\\|[^\\]]*)?\\]\\]',
+                                        re.IGNORECASE)
 
     def __init__(self, content):
         self._content = content
@@ -16,33 +27,80 @@ class Parser(object):
     def content(self):
         return self._content
 
+    @classmethod
+    def redirect_target(cls, content: str) -> Optional[str]:
+        """Get redirect target title of MediaWiki wikitext content
+        :return: target title, or None if content is not a redirect
+        """
+        m = cls._redirect_pattern.match(content)
+        return None if m is None else m.group(1)
+
+    @classmethod
+    def category_names(cls, content: str) -> List[str]:
+        """Get names of categories linked in MediaWiki wikitext content, without duplicates
+
+        Categories added by templates are not included.
+        """
+        names = (m.group(1).replace('_', ' ') for m in cls._category_link_pattern.finditer(content))
+        return list(dict.fromkeys(name[:1].upper() + name[1:] for name in names))
+
     def to_markdown(self) -> Parser:
-        self._content = self._content \
-            .replace("'''", '**') \
-            .replace("''", '*')
+        self._content = self._emphasis_pattern.sub(lambda m: self._emphasis_markdown[m.group(0)], self._content)
         self._content = self.__replace_links(self._content)
         return self
 
+    def to_plain_text(self) -> Parser:
+        """Remove emphasis markup, and replace links with their text"""
+        self._content = self._emphasis_pattern.sub('', self._content)
+        self._content = self._link_pattern.sub(lambda m: m.group(2) or m.group(1), self._content)
+        return self
+
     @classmethod
     def __replace_links(cls, content: str) -> str:
-        while True:
-            match = re.search('\\[\\[([^|\\]]+)(?:\\|([^\\]]+))?\\]\\]', content)
-            if match is None:
-                return content
-            target = match.group(1)
-            name = match.group(2) or target
-            link = '[{}](#{})'.format(name, target.replace(' ', '-').lower())
-            content = content[:match.start()] + link + content[match.end():]
+        return cls._link_pattern.sub(cls.__markdown_link, content)
+
+    @staticmethod
+    def __markdown_link(match) -> str:
+        target = match.group(1)
+        name = match.group(2) or target
+        return '[{}](#{})'.format(name, target.replace(' ', '-').lower())
 
     def get_first_section(self) -> Parser:
         """Get cleaned-up first section from MediaWiki wikitext content
         :return: first section, with templates removed
         """
-        wiki_code = mwparserfromhell.parse(self._content)
-        sections = wiki_code.get_sections()
-        self._content = sections[0].strip() if len(sections) > 0 else ''
+        lead = self._lead_section(self._content)
+        if lead is None:
+            wiki_code = mwparserfromhell.parse(self._content)
+            sections = wiki_code.get_sections()
+            lead = sections[0] if len(sections) > 0 else ''
+        self._content = lead.strip()
         return self
 
+    @classmethod
+    def _lead_section(cls, content: str) -> Optional[str]:
+        """Get text before first heading, parsing only the beginning of content
+
+        Headings start at line start with '='. Parse content up to the first such line, and if it
+        contains a heading, return text before it. If the heading line or text before it has unclosed markup
+        (comment, tag, template, table, link or bold/italic), that might hide the heading in the full parse,
+        give up.
+
+        :return: lead section text, or None if full content needs to be parsed
+        """
+        for i, match in enumerate(cls._heading_candidate.finditer(content)):
+            if i == cls._lead_max_candidates or cls._unclosed_markup.search(match.group(0)):
+                return None
+            nodes = mwparserfromhell.parse(content[:match.end()]).nodes
+            heading_idx = next((j for j, node in enumerate(nodes) if isinstance(node, Heading)), None)
+            if heading_idx is None:
+                continue
+            lead = Wikicode(nodes[:heading_idx])
+            if any(cls._unclosed_markup.search(text.value) for text in lead.filter_text()):
+                return None
+            return str(lead)
+        return content
+
     def remove_templates(self) -> Parser:
         """Remove MediaWiki wikitext templates from content string
         :return: content, with templates removed
@@ -51,23 +109,26 @@ class Parser(object):
         return self
 
     def remove_category_links(self) -> Parser:
-        self._content = re.sub('\\[\\[Category:[^\\]]+\\]\\]', '', self._content)
+        self._content = self._category_link_pattern.sub('', self._content)
         return self
 
     @classmethod
     def _remove_templates(cls, content) -> str:
-        while True:
-            start_idx = content.find(cls.template_start_delimiter)
-            stop_idx = content.find(cls.template_stop_delimiter, start_idx + len(cls.template_start_delimiter))
-            if start_idx == -1 or stop_idx == -1:
-                return content
-
-            next_start_idx = content.find(cls.template_start_delimiter, start_idx + len(cls.template_start_delimiter))
-            if next_start_idx != -1 and next_start_idx < stop_idx:
-                # Nested content found
-                content = content[:next_start_idx] + \
-                          cls._remove_templates(content[next_start_idx:stop_idx + len(cls.template_stop_delimiter)]) + \
-                          content[stop_idx + len(cls.template_stop_delimiter):]
-                continue
+        """Remove innermost '{{...}}' templates first, in a single scan
 
-            content = content[:start_idx] + content[stop_idx + len(cls.template_stop_delimiter):]
+        Output is collected as chunks, with template start positions on a stack. On '}}', output is
+        truncated to the latest unclosed '{{'. Unmatched '{{' and '}}' are kept as they are.
+        """
+        out = []
+        starts = []
+        for match in cls._template_tokens.finditer(content):
+            token = match.group(0)
+            if token == '{' and len(out) > 0 and out[-1] == '{':
+                out.pop()
+                starts.append(len(out))
+                out.append('{{')
+            elif token == '}' and len(out) > 0 and out[-1] == '}' and len(starts) > 0:
+                del out[starts.pop():]
+            else:
+                out.append(token)
+        return ''.join(out)
@@ -0,0 +1,116 @@
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text, bindparam
+from sqlalchemy.orm import Session
+
+from wikidict.model import WikiPage, iter_page_ids
+from wikidict.parser import Parser
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = 'page_search'
+
+
+def render_search_text(content: Optional[str]) -> str:
+    """Render indexed plain text of a page from MediaWiki wikitext: first section without markup"""
+    return "" if content is None else Parser(content)\
+        .remove_templates()\
+        .get_first_section()\
+        .remove_category_links()\
+        .to_plain_text()\
+        .content
+
+
+def search_index_exists(session: Session) -> bool:
+    return session.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                           {'name': SEARCH_TABLE}).scalar() is not None
+
+
+def create_search_index(session: Session, batch_size: int = 500) -> bool:
+    """Create search index, if it does not exist, and index all pages. Commit.
+
+    The index is an SQLite FTS5 table of page titles and first section text. Once created, it is kept up
+    to date as pages are written, deleted or turned into redirects.
+
+    :param session: sql database session
+    :param batch_size: number of pages to index and commit at once
+    :return: True if index was created, False if it existed already
+    """
+    if search_index_exists(session):
+        return False
+
+    logger.info('Create search index')
+    session.execute(text("CREATE VIRTUAL TABLE {} USING fts5(title, body, tokenize='unicode61 remove_diacritics 2')"
+                         .format(SEARCH_TABLE)))
+    page_ids = []
+    for page_id in iter_page_ids(session, WikiPage.redirect_title == None,  # noqa: E711
+                                 WikiPage.content != None, batch_size=batch_size):  # noqa: E711
+        page_ids.append(page_id)
+        if len(page_ids) >= batch_size:
+            _index_page_ids(session, page_ids)
+            page_ids = []
+    _index_page_ids(session, page_ids)
+    return True
+
+
+def _index_page_ids(session: Session, page_ids: List[int]) -> None:
+    if len(page_ids) > 0:
+        pages = session.query(WikiPage.id, WikiPage.title, WikiPage.content).filter(WikiPage.id.in_(page_ids))
+        update_search_index(session, [{'id': page_id, 'title': title, 'content': content, 'redirect_title': None}
+                                      for page_id, title, content in pages])
+    session.commit()
+
+
+def update_search_index(session: Session, pages: Iterable[Dict]) -> None:
+    """Replace search index entries of pages, if search index exists. Do not commit.
+
+    :param session: sql database session
+    :param pages: dicts with keys id, title, content and redirect_title. Redirect pages are removed from index.
+    """
+    if not search_index_exists(session):
+        return
+    pages = list(pages)
+    remove_from_search_index(session, page_ids=[page['id'] for page in pages])
+    rows = [{'id': page['id'], 'title': page['title'], 'body': render_search_text(page['content'])}
+            for page in pages if page['redirect_title'] is None]
+    if len(rows) > 0:
+        session.execute(text('INSERT INTO {} (rowid, title, body) VALUES (:id, :title, :body)'.format(SEARCH_TABLE)),
+                        rows)
+
+
+def remove_from_search_index(session: Session, page_ids: Iterable[int] = None, titles: Iterable[str] = None) -> None:
+    """Remove pages from search index, if search index exists. Do not commit.
+
+    :param session: sql database session
+    :param page_ids: page IDs
+    :param titles: page titles, alternative to page IDs; pages must be in database
+    """
+    if not search_index_exists(session):
+        return
+    if page_ids is not None:
+        keys, statement = list(page_ids), 'DELETE FROM {} WHERE rowid IN :keys'
+    else:
+        keys, statement = list(titles), 'DELETE FROM {} WHERE rowid IN (SELECT id FROM pages WHERE title IN :keys)'
+    statement = text(statement.format(SEARCH_TABLE)).bindparams(bindparam('keys', expanding=True))
+    for i in range(0, len(keys), 500):
+        session.execute(statement, {'keys': keys[i:i + 500]})
+
+
+def search(session: Session, query: str, limit: int = 20, raw: bool = False) -> List[Tuple[str, str]]:
+    """Search pages, best matches first. Matches in title weigh more than in text.
+
+    :param session: sql database session
+    :param query: search terms; all terms must match
+    :param limit: maximum number of results
+    :param raw: query is in FTS5 query syntax, e.g. 'jon AND (snow OR stark)', 'tar*'
+    :return: list of (title, text snippet with matches in brackets)
+    :raises ValueError: if search index does not exist
+    """
+    if not search_index_exists(session):
+        raise ValueError('Search index does not exist')
+    if not raw:
+        query = ' '.join('"{}"'.format(term.replace('"', '""')) for term in query.split())
+    statement = text("SELECT title, snippet({0}, 1, '[', ']', '...', 16) FROM {0} WHERE {0} MATCH :query "
+                     "ORDER BY bm25({0}, 10.0, 1.0) LIMIT :limit".format(SEARCH_TABLE))
+    return [(title, snippet) for title, snippet in session.execute(statement, {'query': query, 'limit': limit})]
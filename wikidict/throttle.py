@@ -0,0 +1,63 @@
+import random
+import threading
+import time
+
+
+class RateLimiter(object):
+    """Token bucket rate limiter for requests to a host, shared between threads
+
+    Records total time spent waiting, including pauses requested with :meth:`pause`.
+    """
+
+    def __init__(self, max_per_second: float = None, burst: int = 1):
+        """
+        :param max_per_second: maximum sustained number of requests per second; None: no limit
+        :param burst: number of requests that may be made at once, after a period of inactivity
+        """
+        self.rate = max_per_second
+        self.capacity = burst
+        self.waited = 0.0
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def wait(self) -> float:
+        """Block until next request is allowed
+
+        :return: waiting time in seconds
+        """
+        with self._lock:
+            now = time.monotonic()
+            ready = max(now, self._paused_until)
+            if self.rate:
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                self._tokens -= 1
+                if self._tokens < 0:
+                    ready = max(ready, now - self._tokens / self.rate)
+            delay = ready - now
+            self.waited += delay
+
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def pause(self, seconds: float) -> None:
+        """Hold all requests for the given time, e.g. when server asks to back off"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+def backoff_delay(attempt: int, retry_after: float = None, base: float = 1.0, max_delay: float = 120.0) -> float:
+    """Get delay before retrying a failed request: exponential backoff with jitter
+
+    :param attempt: number of failed attempts before this one, starting from 0
+    :param retry_after: delay requested by server, e.g. Retry-After header; used as minimum
+    :param base: delay after first failure, before jitter
+    :param max_delay: maximum delay, before jitter
+    :return: delay in seconds
+    """
+    delay = min(max_delay, base * 2 ** attempt)
+    delay = delay / 2 + random.uniform(0, delay / 2)
+    return max(delay, retry_after or 0.0)
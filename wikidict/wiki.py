@@ -1,50 +1,297 @@
+import json
 import logging
 import re
-from itertools import zip_longest
-from typing import Iterator, List, Iterable, Tuple, Dict, Any, Callable
-
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest, islice, count
+from typing import Iterator, List, Iterable, Tuple, Dict, Any, Callable, Optional
+
+import requests
 from mediawiki import MediaWiki, MediaWikiException
-from sqlalchemy import or_
+from requests.adapters import HTTPAdapter
+from sqlalchemy import or_, select, func, bindparam
 from sqlalchemy.orm import Session
 
-from wikidict.model import WikiPage, Category, get_or_create
+from wikidict.model import WikiPage, CategoryCache, RenderedEntry, upsert, category_association, get_state, \
+    set_state, replace_category_links, iter_page_ids
+from wikidict.parser import Parser
+from wikidict.search import update_search_index, remove_from_search_index
+from wikidict.throttle import RateLimiter, backoff_delay
 
 logger = logging.getLogger(__name__)
 
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+MAXLAG_RETRY_AFTER = 5
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def configure_http_session(session: requests.Session, pool_size: int = 10) -> None:
+    """Configure HTTP session for keep-alive connection pool and compressed responses
+
+    The session is modified in place, so that its other settings, e.g. User-Agent, authentication, proxies,
+    SSL verification and cookies, are kept.
+
+    :param session: requests session, e.g. of MediaWiki client, see :func:`configure_wiki_session`
+    :param pool_size: maximum number of connections kept open per host. Requests over the limit wait for a free
+        connection, instead of opening a new one.
+    """
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+    })
+    if _raise_for_retry_status not in session.hooks['response']:
+        session.hooks['response'].append(_raise_for_retry_status)
+
+
+def configure_wiki_session(wiki: MediaWiki, pool_size: int = 10) -> None:
+    """Configure HTTP session of MediaWiki client, see :func:`configure_http_session`
+
+    pymediawiki has no argument for the session, so its session attribute is configured. Changing client
+    settings afterwards, e.g. user agent, makes the client create a new session, which must be configured again.
+    """
+    configure_http_session(wiki._session, pool_size=pool_size)
+
+
+class MaxlagError(requests.HTTPError):
+    """API refused request, because database replication lag is over maxlag parameter"""
+
+
+def _raise_for_retry_status(response: requests.Response, *args, **kwargs) -> None:
+    """Response hook: raise HTTPError on status codes that should be retried, and MaxlagError on maxlag errors
+
+    pymediawiki does not check the status code, and would return an empty result for error pages.
+    Maxlag errors have status 200, and are recognized by header, so that their Retry-After header can be read.
+    """
+    if response.headers.get('MediaWiki-API-Error') == 'maxlag':
+        raise MaxlagError('Database lagged {} s'.format(response.headers.get('X-Database-Lag')), response=response)
+    if response.status_code in RETRY_STATUS_CODES:
+        response.raise_for_status()
+
+
+def _retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    """Parse Retry-After header value in seconds; HTTP dates are not supported and give None"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
 
 class WikiDownloader(object):
 
-    def __init__(self, wiki: MediaWiki):
+    def __init__(self, wiki: MediaWiki, workers: int = 1, max_requests_per_second: float = None,
+                 max_retries: int = 5, maxlag: int = None, recent_changes_max_age: int = 30):
+        """
+        :param wiki: MediaWiki API client
+        :param workers: number of concurrent requests to keep in flight when downloading page batches
+        :param max_requests_per_second: maximum request rate to the wiki; None: no limit
+        :param max_retries: number of times to retry a request after rate limiting, server or connection errors
+        :param maxlag: maximum database replication lag in seconds, see
+            https://www.mediawiki.org/wiki/Manual:Maxlag_parameter; None: do not send
+        :param recent_changes_max_age: days that the wiki keeps recent changes, see
+            https://www.mediawiki.org/wiki/Manual:$wgRCMaxAge. Older syncs are not updated incrementally.
+        """
         self.wiki = wiki
+        self.workers = workers
+        self.rate_limiter = RateLimiter(max_requests_per_second, burst=max(1, workers))
+        self.max_retries = max_retries
+        self.maxlag = maxlag
+        self.recent_changes_max_age = recent_changes_max_age
+        self.retries = 0
+        self._retries_lock = threading.Lock()
+
+        # Request limits, see detect_limits
+        self.max_list_size = 500
+        self.max_batch_size = 50
+        self.content_batch_size = self.max_batch_size
+        self.use_slots = False
+
+    def detect_limits(self) -> None:
+        """Detect request limits of the API for the current user
+
+        With 'apihighlimits' right (e.g. bot accounts), lists may be 10x longer and more page IDs/titles
+        may be queried in one request. Maximum page IDs per request is read from module parameter info.
+        Revision content is requested with slots on MediaWiki >= 1.32.
+        """
+        response = self._request({'meta': 'userinfo|siteinfo', 'uiprop': 'rights', 'siprop': 'general'})
+        high_limits = 'apihighlimits' in response['query']['userinfo'].get('rights', [])
+        m = re.match('MediaWiki (\\d+)\\.(\\d+)', response['query']['general']['generator'])
+        self.use_slots = m is not None and (int(m.group(1)), int(m.group(2))) >= (1, 32)
+
+        response = self._request({'action': 'paraminfo', 'modules': 'query'})
+        parameters = {p['name']: p for p in response['paraminfo']['modules'][0]['parameters']}
+        self.max_batch_size = parameters['pageids']['highlimit' if high_limits else 'limit']
+        self.content_batch_size = self.max_batch_size
+        self.max_list_size = 5000 if high_limits else 500
+
+        logger.info('API limits: {} pages per request, {} list items per request, slots: {}'.format(
+            self.max_batch_size, self.max_list_size, self.use_slots))
+
+    def update_page_index(self, session: Session, incremental=False) -> None:
+        """Bring page list and latest revision IDs up to date, commit to database
+
+        Record server time of the update as sync state 'last_sync'. A full page list sweep is recorded as
+        sync phase 'page_list' while in progress, and resumed from its checkpoint if the previous run was
+        interrupted.
+
+        :param session: sql database session
+        :param incremental: apply recent changes since last sync, see :meth:`update_recent_changes`.
+            Sweep all pages if False, or if the database has not been synced before.
+        """
+        if get_state(session, 'sync_phase') == 'page_list':
+            timestamp = get_state(session, 'sync_started')
+            logger.info('Resume page list sweep started at {}'.format(timestamp))
+            self.get_page_list(session, revisions=True)
+        else:
+            timestamp = self._server_timestamp()
+            if not (incremental and self.update_recent_changes(session, now=timestamp)):
+                set_state(session, 'sync_phase', 'page_list')
+                set_state(session, 'sync_started', timestamp)
+                session.commit()
+                self.get_page_list(session, revisions=True)
+
+        set_state(session, 'last_sync', timestamp)
+        set_state(session, 'sync_phase', None)
+        set_state(session, 'sync_started', None)
+        session.commit()
+
+    def update_recent_changes(self, session: Session, now: str = None) -> bool:
+        """Update page list and latest revision IDs from recent changes since last sync, commit to database
+
+        Edited and new pages get their latest revision ID, deleted pages are removed, and for moved and
+        restored pages the revisions are queried by title. Stored pages with the title of a deleted, edited
+        or new page, but another page ID, are removed, e.g. when a page was deleted and created again.
+
+        :param session: sql database session
+        :param now: current server time as ISO 8601 timestamp; None: query from server
+        :return: True if changes were applied, False if there is no last sync time in database, or if last sync
+            is older than the wiki keeps recent changes
+        """
+        since = get_state(session, 'last_sync')
+        if since is None:
+            return False
+        now = now or self._server_timestamp()
+        cutoff = datetime.strptime(now, TIMESTAMP_FORMAT) - timedelta(days=self.recent_changes_max_age)
+        if datetime.strptime(since, TIMESTAMP_FORMAT) < cutoff:
+            logger.warning('Last sync {} is older than recent changes kept by the wiki ({} days), '
+                           'update all pages'.format(since, self.recent_changes_max_age))
+            return False
+
+        logger.info('Update recent changes since {}'.format(since))
+        query_params = {
+            'list': 'recentchanges',
+            'rcstart': since,
+            'rcdir': 'newer',
+            'rcnamespace': 0,
+            'rctype': 'edit|new|log',
+            'rcprop': 'title|ids|loginfo',
+            'rclimit': 'max',
+        }
+
+        revisions: Dict[int, Dict] = {}
+        deleted_titles = set()
+        refresh_titles = set()
+        for change in self._continued_response(query_params, lambda response: response['query']['recentchanges']):
+            title = change['title']
+            if change['type'] in ('edit', 'new'):
+                revisions[change['pageid']] = {'id': change['pageid'], 'title': title,
+                                               'latest_revision_online': change['revid']}
+            elif change.get('logtype') == 'delete' and change.get('logaction') == 'delete':
+                revisions = {page_id: row for page_id, row in revisions.items() if row['title'] != title}
+                deleted_titles.add(title)
+            elif change.get('logtype') in ('move', 'delete'):
+                refresh_titles.add(title)
+                if 'target_title' in change.get('logparams', {}):
+                    refresh_titles.add(change['logparams']['target_title'])
+
+        self._delete_pages(session, deleted_titles | {row['title'] for row in revisions.values()},
+                           keep_ids=set(revisions))
+        upsert(session, WikiPage.__table__, revisions.values())
+        session.commit()
+        logger.info('Recent changes: {} revised, {} deleted, {} moved or restored pages'.format(
+            len(revisions), len(deleted_titles), len(refresh_titles)))
+
+        if len(refresh_titles) > 0:
+            self.update_latest_revisions(session, page_titles=refresh_titles)
+        return True
 
-    def get_page_list(self, session: Session, query_from='', max_pages: int = None) -> None:
+    @staticmethod
+    def _delete_pages(session: Session, titles: Iterable[str], keep_ids: Iterable[int] = ()) -> None:
+        """Delete pages by title, with category links, rendered entries and search index entries. Do not commit.
+
+        :param session: sql database session
+        :param titles: page titles
+        :param keep_ids: do not delete pages with these IDs
+        """
+        pages = WikiPage.__table__
+        keep_ids = set(keep_ids)
+        for group in WikiDownloader._iterable_grouper(titles, n=500):
+            page_ids = [page_id for (page_id,) in session.query(WikiPage.id).filter(
+                WikiPage.title.in_([title for title in group if title is not None])) if page_id not in keep_ids]
+            if len(page_ids) == 0:
+                continue
+            session.execute(category_association.delete().where(category_association.c.page_id.in_(page_ids)))
+            session.execute(RenderedEntry.__table__.delete().where(RenderedEntry.page_id.in_(page_ids)))
+            remove_from_search_index(session, page_ids=page_ids)
+            session.execute(pages.update().where(pages.c.redirect_to_id.in_(page_ids)).values(redirect_to_id=None))
+            session.execute(pages.delete().where(pages.c.id.in_(page_ids)))
+
+    def _server_timestamp(self) -> str:
+        """Get current time of the wiki server, as ISO 8601 timestamp"""
+        return self._request({'curtimestamp': 1})['curtimestamp']
+
+    def get_page_list(self, session: Session, query_from='', max_pages: int = None, revisions=False) -> None:
         """Get pages (id & title), commit to database
 
         :param session: sql database session
         :param query_from: query: get page names starting from this (empty string: from the beginning)
         :param max_pages: fetch at maximum this amount of results, until returning; None: get until exhaustion
+        :param revisions: get also latest revision IDs in the same pass, with generator=allpages
+
+        A full list (max_pages None) is checkpointed as sync state 'page_list_continue' after each response, and
+        an interrupted list is continued from the checkpoint instead of query_from.
         """
         logger.info("Get page list")
 
-        n_batch = 500 if (max_pages is None or max_pages > 500) else max_pages
-        query_params = {'list': 'allpages', 'aplimit': n_batch, 'apfrom': query_from}
+        n_batch = self.max_list_size if (max_pages is None or max_pages > self.max_list_size) else max_pages
+        if revisions:
+            query_params = {'generator': 'allpages', 'gaplimit': n_batch, 'gapfrom': query_from,
+                            'prop': 'revisions', 'rvprop': 'ids'}
+        else:
+            query_params = {'list': 'allpages', 'aplimit': n_batch, 'apfrom': query_from}
 
         page_iterator = self._continued_response(
-            query_params, lambda response: self._merge_page_list(response=response, session=session), max_pages)
+            query_params, lambda response: self._merge_page_list(response=response, session=session), max_pages,
+            checkpoint=(session, 'page_list_continue') if max_pages is None else None)
 
         list(page_iterator)
 
-
     @staticmethod
     def _merge_page_list(response: Dict, session: Session) -> List[int]:
-        ret = []
-        for page_dict in response['query']['allpages']:
-            ret.append(page_dict['pageid'])
-            page = WikiPage(id=page_dict['pageid'], title=page_dict['title'])
-            session.merge(page)
+        """Upsert pages from list=allpages or generator=allpages response, and commit
+
+        :return: page IDs in response
+        """
+        query = response.get('query', {})  # Left out, if generator yields no pages
+        if 'allpages' in query:
+            rows = [{'id': page_dict['pageid'], 'title': page_dict['title']}
+                    for page_dict in query['allpages']]
+        else:
+            rows = []
+            for page_dict in sorted(query.get('pages', {}).values(), key=lambda p: p['title']):
+                row = {'id': page_dict['pageid'], 'title': page_dict['title']}
+                if 'revisions' in page_dict:
+                    row['latest_revision_online'] = page_dict['revisions'][0]['revid']
+                rows.append(row)
+        upsert(session, WikiPage.__table__, rows)
         session.commit()
 
-        return ret
+        return [row['id'] for row in rows]
 
     def update_latest_revisions(self, session: Session, page_ids: Iterable[int] = None,
                                 page_titles: Iterable[str] = None) -> None:
@@ -53,10 +300,11 @@ class WikiDownloader(object):
         :param session: sql database session
         :param page_ids: page IDs. If None, use page_titles.
         :param page_titles: page titles, alternative to page IDs. If both lists are None, get list from database.
+
+        Up to `workers` batches are requested concurrently, see :meth:`_fetch_batches`.
         """
         logger.info('Update latest revisions')
 
-        max_pages = 50
         query_params = {
             'prop': 'revisions',
             'rvprop': 'ids',
@@ -64,43 +312,60 @@ class WikiDownloader(object):
 
         if page_ids is None and page_titles is None:
             based_on = 'pageids'
-            page_ids = (page.id for page in session.query(WikiPage))
+            page_ids = iter_page_ids(session)
         else:
             based_on = 'pageids' if page_ids is not None else 'titles'
 
-        # Take page batches from input iterator
-        for group in self._iterable_grouper(page_ids or page_titles, n=max_pages):
-            query_params[based_on] = '|'.join(str(s) for s in group if s is not None)
-            logger.debug('Update latest revisions: {}={}'.format(based_on, query_params[based_on]))
-
-            for (page_id, revision_id) in self._continued_response(query_params, self._parse_revision):
-                session.merge(WikiPage(id=page_id, latest_revision_online=revision_id))
+        def batch_params(group):
+            params = dict(query_params)
+            params[based_on] = '|'.join(str(s) for s in group if s is not None)
+            logger.debug('Update latest revisions: {}={}'.format(based_on, params[based_on]))
+            return params
+
+        # Take page batches from input iterator; next batches are requested while previous one is written
+        batches = (batch_params(group)
+                   for group in self._iterable_grouper(page_ids or page_titles, n=self.max_batch_size))
+        for responses in self._fetch_batches(batches):
+            for response in responses:
+                upsert(session, WikiPage.__table__,
+                       [{'id': page_id, 'title': title, 'latest_revision_online': revision_id}
+                        for (page_id, title, revision_id) in self._parse_revision(response)])
 
             session.commit()
 
     @staticmethod
-    def _parse_revision(response) -> List[Tuple[int, int]]:
-        """Parse revision ids from response
+    def _parse_revision(response) -> List[Tuple[int, str, int]]:
+        """Parse revision ids from response, skip missing pages
         :param response: parsed dict from requests.Session.get().json()
-        :return: List of tuples (page id -> revision id)
+        :return: List of tuples (page id, title, revision id)
         """
-        response_pages = response['query']['pages']
-        return [(response_pages[i]['pageid'], response_pages[i]['revisions'][0]['revid'])
-                for i in response_pages]
+        response_pages = response['query']['pages'].values()
+        return [(page['pageid'], page['title'], page['revisions'][0]['revid'])
+                for page in response_pages if 'revisions' in page]
 
     def _continued_response(self, query_params: Dict, result_parse_func: Callable[[Dict], Any],
-                            max_results: int = None) -> Iterator[Any]:
+                            max_results: int = None, checkpoint: Tuple[Session, str] = None) -> Iterator[Any]:
         """Process continued response from MediaWiki API
 
         Follow 'continue' links until result is exhausted
         :param query_params: query parameters to wiki request
         :param result_parse_func: function that is employed to parse request JSON
         :param max_results: fetch at maximum this amount of results, until returning; None: get until exhaustion
+        :param checkpoint: database session and sync state name. Continue parameters are stored and committed
+            after results of each response have been consumed, and removed when result is exhausted. If the
+            state exists on start, the query is continued from there.
         :return: iterator of result_parse_func results
         """
+        state_session, state_name = checkpoint or (None, None)
+        if state_name is not None:
+            saved = get_state(state_session, state_name)
+            if saved is not None:
+                logger.info('Continue query from checkpoint {}'.format(saved))
+                query_params.update(json.loads(saved))
+
         result_idx = 1
         while True:
-            response = self.wiki.wiki_request(query_params)
+            response = self._request(query_params)
             if 'error' in response:
                 raise MediaWikiException(response['error']['info'])
             if 'warnings' in response:
@@ -117,32 +382,114 @@ class WikiDownloader(object):
                 break
             else:
                 query_params.update(response['continue'])
+                if state_name is not None:
+                    set_state(state_session, state_name, json.dumps(response['continue']))
+                    state_session.commit()
+
+        if state_name is not None:
+            set_state(state_session, state_name, None)
+            state_session.commit()
+
+    def _request(self, query_params: Dict) -> Dict:
+        """Make a rate limited request to the wiki API
+
+        Failed requests are retried with exponential backoff on HTTP 429 and 5xx responses, connection errors and
+        timeouts, and when the API reports replication lag over `maxlag`. While backing off, requests from other
+        threads are held as well.
+
+        :param query_params: query parameters to wiki request
+        :return: parsed response
+        :raises MediaWikiException: if request still fails after `max_retries` retries
+        """
+        if self.maxlag is not None:
+            query_params = dict(query_params, maxlag=self.maxlag)
+
+        for attempt in count():
+            self.rate_limiter.wait()
+            retry_after = None
+            try:
+                response = self.wiki.wiki_request(query_params)
+            except MaxlagError as e:
+                reason = 'Server lagged: {}'.format(e)
+                retry_after = _retry_after_seconds(e.response.headers.get('Retry-After')) or MAXLAG_RETRY_AFTER
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code not in RETRY_STATUS_CODES:
+                    raise
+                reason = 'HTTP status {}'.format(e.response.status_code)
+                retry_after = _retry_after_seconds(e.response.headers.get('Retry-After'))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                reason = str(e)
+            else:
+                error = response.get('error', {})
+                if error.get('code') == 'maxlag':
+                    reason = 'Server lagged: {}'.format(error.get('info'))
+                    retry_after = MAXLAG_RETRY_AFTER
+                elif not response:
+                    reason = 'Empty response'
+                else:
+                    return response
+
+            if attempt >= self.max_retries:
+                raise MediaWikiException('Request failed after {} retries: {}'.format(attempt, reason))
+            delay = backoff_delay(attempt, retry_after)
+            logger.warning('{}, retrying in {:.1f} s'.format(reason, delay))
+            with self._retries_lock:
+                self.retries += 1
+            self.rate_limiter.pause(delay)
+
+    def _fetch_batches(self, batches: Iterable[Dict]) -> Iterator[List[Dict]]:
+        """Fetch continued responses for query parameter batches, using a pool of worker threads
 
-    def update_outdated_pages(self, session: Session) -> List[int]:
+        Up to `workers` batches are requested concurrently, and one more is kept queued, so that
+        network requests proceed while the caller processes results. Batches are consumed from
+        the input iterator in the calling thread, and results are returned in input order.
+
+        :param batches: query parameters, one dict for each batch
+        :return: iterator of response lists, one list for each batch
+        """
+        def fetch(params: Dict) -> List[Dict]:
+            return list(self._continued_response(params, lambda response: [response]))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            for params in batches:
+                pending.append(executor.submit(fetch, params))
+                if len(pending) > self.workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def update_outdated_pages(self, session: Session, resolve_redirects=False) -> List[int]:
         """Check database table 'pages', download outdated pages
 
         Download pages, whose revision_id < latest_revision_online. Save to database.
 
         :param session: sql database session
+        :param resolve_redirects: let the API resolve redirects, see :meth:`update_pages`
         :return: downloaded page IDs
         """
         logger.info('Update outdated pages')
-        pages = session.query(WikiPage) \
-            .filter(or_(WikiPage.revision_id == None,  # noqa: E711
-                        WikiPage.revision_id < WikiPage.latest_revision_online))
-        return self.update_pages(session, page_ids=(p.id for p in pages), follow_redirects=False)
+        page_ids = iter_page_ids(session, or_(WikiPage.revision_id == None,  # noqa: E711
+                                              WikiPage.revision_id < WikiPage.latest_revision_online))
+        return self.update_pages(session, page_ids=page_ids, follow_redirects=False,
+                                 resolve_redirects=resolve_redirects)
 
     def update_pages(self, session: Session, page_ids: Iterable[int] = None, page_titles: Iterable[str] = None,
-                     follow_redirects=True):
+                     follow_redirects=True, resolve_redirects=False):
         """Download pages, save to database.
 
         :param session: sql database session
         :param page_ids: page IDs. If None, use page_titles.
         :param page_titles: page titles, alternative to page IDs.
-        :param follow_redirects: re-download redirected pages and update those in database
+        :param follow_redirects: download targets of redirect pages, unless their content is up to date,
+            and link redirects to them
+        :param resolve_redirects: request with redirects=1, so that the API returns redirect targets in place of
+            redirect pages. Redirect pages are linked to targets and marked up to date, without downloading content.
         :return: downloaded page IDs
+
+        Batch size is adapted to response size: if the API cannot return content of all pages in a batch
+        at once, following batches are made smaller, otherwise they grow up to `max_batch_size`.
         """
-        max_pages = 50
         query_params = {
             'prop': 'revisions|categories',
             # Revisions (content)
@@ -151,28 +498,39 @@ class WikiDownloader(object):
             'cllimit': 'max',
             'clshow': '!hidden',
         }
+        if resolve_redirects:
+            query_params['redirects'] = 1
+        if self.use_slots:
+            query_params['rvslots'] = 'main'
 
         based_on = 'pageids' if page_ids is not None else 'titles'
 
         downloaded_ids: List[int] = []
         redirects: List[Tuple[int, str]] = []
-
-        for group in self._iterable_grouper(page_ids or page_titles, n=max_pages):
-            query_params[based_on] = '|'.join(str(s) for s in group if s is not None)
-            logger.info('Update pages: {}={}'.format(based_on, query_params[based_on]))
-
-            _downloaded, _redirects = self._continued_response(
-                query_params, lambda response: self._parse_pages_and_add(response, session))
-
+        categories = CategoryCache(session)
+
+        def batch_params(group):
+            params = dict(query_params)
+            params[based_on] = '|'.join(str(s) for s in group if s is not None)
+            logger.info('Update pages: {}={}'.format(based_on, params[based_on]))
+            return params
+
+        batches = (batch_params(group)
+                   for group in self._adaptive_grouper(page_ids or page_titles, lambda: self.content_batch_size))
+        for responses in self._fetch_batches(batches):
+            self._adapt_content_batch_size(responses)
+            response = self._merge_continued(responses)
+            _downloaded, _redirects = self._parse_pages_and_add(response, session, categories)
             downloaded_ids.extend(_downloaded)
             redirects.extend(_redirects)
+            self._add_resolved_redirects(response, session)
 
             session.commit()
 
         # Download redirected pages, set connections
         if follow_redirects and len(redirects) > 0:
             redirect_source_ids, redirect_target_titles = zip(*redirects)
-            _downloaded = self.update_pages(session, page_titles=redirect_target_titles,
+            _downloaded = self.update_pages(session, page_titles=self._outdated_titles(session, redirect_target_titles),
                                             follow_redirects=follow_redirects)
             self.link_redirects(session, redirect_source_ids)
 
@@ -180,22 +538,98 @@ class WikiDownloader(object):
 
         return downloaded_ids
 
+    def _adapt_content_batch_size(self, responses: List[Dict]) -> None:
+        """Halve content batch size if revision content was continued, otherwise grow it by a quarter"""
+        if any('rvcontinue' in response.get('continue', {}) for response in responses):
+            self.content_batch_size = max(1, self.content_batch_size // 2)
+        else:
+            self.content_batch_size = min(self.max_batch_size,
+                                          self.content_batch_size + max(1, self.content_batch_size // 4))
+
+    @staticmethod
+    def _merge_continued(responses: List[Dict]) -> Dict:
+        """Merge continued prop query responses, concatenating list properties of each page"""
+        pages: Dict[str, Dict] = {}
+        redirects = []
+        for response in responses:
+            redirects.extend(response['query'].get('redirects', []))
+            for key, obj in response['query'].get('pages', {}).items():
+                page = pages.setdefault(key, {})
+                for name, value in obj.items():
+                    if isinstance(value, list) and name in page:
+                        page[name] = page[name] + value
+                    else:
+                        page.setdefault(name, value)
+        return {'query': {'pages': pages, 'redirects': redirects}}
+
     @staticmethod
-    def _parse_pages_and_add(response: Dict, session: Session) -> Tuple[List[int], List[Tuple[int, str]]]:
+    def _outdated_titles(session: Session, titles: Iterable[str]) -> List[str]:
+        """Get unique titles, that are not in database with up-to-date content"""
+        titles = list(set(titles))
+        current = set()
+        for i in range(0, len(titles), 500):
+            current.update(title for (title,) in session.query(WikiPage.title).filter(
+                WikiPage.title.in_(titles[i:i + 500]), WikiPage.revision_id == WikiPage.latest_revision_online))
+        return [title for title in titles if title not in current]
+
+    @staticmethod
+    def _add_resolved_redirects(response: Dict, session: Session) -> None:
+        """Link redirect pages resolved by the API (redirects=1) to their targets, do not commit
+
+        Redirect pages are found by title. The API does not return their revision, so revision_id and
+        latest_revision_online are both set to latest_revision_online, or revision_id if that is not known, or 0,
+        so that they are not considered outdated until the page index reports a newer revision. Content is
+        replaced with the redirect, and category links and rendered entries of earlier content are removed.
+
+        :param response: parsed dict from requests.Session.get().json()
+        :param session: sql database session
+        """
+        redirects = response['query'].get('redirects', [])
+        if len(redirects) == 0:
+            return
+
+        pages = WikiPage.__table__
+        target = pages.alias('target')
+        target_id = select([target.c.id]).where(target.c.title == bindparam('target_title')).limit(1).as_scalar()
+        current_revision = func.coalesce(pages.c.latest_revision_online, pages.c.revision_id, 0)
+        statement = pages.update() \
+            .where(pages.c.title == bindparam('source_title')) \
+            .values(redirect_title=bindparam('target_title'),
+                    redirect_to_id=func.coalesce(target_id, pages.c.redirect_to_id),
+                    revision_id=current_revision,
+                    latest_revision_online=current_revision,
+                    content=bindparam('content'))
+        session.execute(statement, [{'source_title': r['from'], 'target_title': r['to'],
+                                     'content': '#REDIRECT [[{}]]'.format(r['to'])} for r in redirects])
+
+        titles = [r['from'] for r in redirects]
+        for i in range(0, len(titles), 500):
+            page_ids = [page_id for (page_id,)
+                        in session.query(WikiPage.id).filter(WikiPage.title.in_(titles[i:i + 500]))]
+            replace_category_links(session, page_ids, [])
+            session.execute(RenderedEntry.__table__.delete().where(RenderedEntry.page_id.in_(page_ids)))
+        remove_from_search_index(session, titles=titles)
+
+    @staticmethod
+    def _parse_pages_and_add(response: Dict, session: Session, categories: CategoryCache = None) \
+            -> Tuple[List[int], List[Tuple[int, str]]]:
         """Parse network response, add parsed pages to database
 
         :param response: parsed dict from requests.Session.get().json()
         :param session: sql database session
+        :param categories: category cache of the session; None: load new cache
         :return: list of downloaded page IDs,
                  list of (page ID, target title) tuples for redirects, that need to be resolved
         """
         downloaded_ids = []
         pending_redirects = []
+        page_rows = []
+        category_links = []
         for i in response['query']['pages']:
             obj = response['query']['pages'][i]
 
             if 'missing' in obj:
-                logger.warning('Missing object in API request result: ' + obj)
+                logger.warning('Missing object in API request result: {}'.format(obj))
                 continue
 
             title = obj['title']
@@ -203,54 +637,62 @@ class WikiDownloader(object):
 
             logger.debug("Parsing wiki page for '{}'".format(title))
 
-            content = obj['revisions'][0]['*']
-
-            downloaded_ids.append(page_id)
-
-            m = re.match('#REDIRECT \\[\\[([^\\]]+)\\]\\].*', content)
-            if m is not None:
-                pending_redirects.append((page_id, m.group(1)))
+            if 'revisions' not in obj:
+                logger.warning('No revision content in API request result: {}'.format(title))
+                continue
 
-            page = session.query(WikiPage).get(page_id) or WikiPage(id=page_id)
+            if 'categories' in obj:
+                category_names = dict.fromkeys(re.sub('^Category:', '', category_obj['title'])
+                                               for category_obj in obj['categories'])
+                category_links.extend((page_id, name) for name in category_names)
 
-            page.revision_id = obj['revisions'][0]['revid']
-            page.latest_revision_online = obj['revisions'][0]['revid']
-            page.content = content
-            page.title = title
+            revision = obj['revisions'][0]
+            content = revision['slots']['main']['*'] if 'slots' in revision else revision['*']
 
-            logger.debug("Page: " + str(page))
+            downloaded_ids.append(page_id)
 
-            if 'categories' in obj:
-                for category_obj in obj['categories']:
-                    cat = get_or_create(session, Category, name=re.sub('^Category:', '', category_obj['title']))
-                    page.categories.append(cat)
+            row = {
+                'id': page_id,
+                'revision_id': revision['revid'],
+                'latest_revision_online': revision['revid'],
+                'content': content,
+                'title': title,
+                'redirect_title': Parser.redirect_target(content),
+            }
+            if row['redirect_title'] is not None:
+                pending_redirects.append((page_id, row['redirect_title']))
+            else:
+                row['redirect_to_id'] = None
+            page_rows.append(row)
 
-            session.merge(page)
+        upsert(session, WikiPage.__table__, page_rows)
+        replace_category_links(session, downloaded_ids, category_links, categories)
+        update_search_index(session, page_rows)
 
         return downloaded_ids, pending_redirects
 
     @staticmethod
-    def link_redirects(session: Session, page_ids: List[int]):
-        """Link redirection pages and commit
+    def link_redirects(session: Session, page_ids: Iterable[int] = None):
+        """Link redirection pages to their targets by redirect_title, and commit
+
+        Links are set with one UPDATE statement, looking up target pages by title. Existing links
+        are kept for redirects, whose target page is not in database.
 
         :param session: sql database session
-        :param page_ids: page IDs, from which to resolve the redirects
+        :param page_ids: page IDs, from which to resolve the redirects; None: all pages in database
         """
-        for source_id in page_ids:
-            source_page: WikiPage = session.query(WikiPage).get(source_id)
-            m = re.match('#REDIRECT \\[\\[([^\\]]+)\\]\\].*', source_page.content)
-
-            if m is None:
-                continue
-
-            target_title = m.group(1)
-            target_page = session.query(WikiPage).filter(WikiPage.title == target_title).first()
-
-            if target_page is None:
-                continue
-
-            source_page.redirect_to = target_page
-            session.add(source_page, target_page)
+        pages = WikiPage.__table__
+        target = pages.alias('target')
+        target_id = select([target.c.id]).where(target.c.title == pages.c.redirect_title).limit(1).as_scalar()
+        statement = pages.update() \
+            .where(pages.c.redirect_title != None) \
+            .values(redirect_to_id=func.coalesce(target_id, pages.c.redirect_to_id))  # noqa: E711
+
+        if page_ids is None:
+            session.execute(statement)
+        else:
+            for group in WikiDownloader._iterable_grouper(page_ids, n=500):
+                session.execute(statement.where(pages.c.id.in_([i for i in group if i is not None])))
 
         session.commit()
 
@@ -258,3 +700,13 @@ class WikiDownloader(object):
     def _iterable_grouper(iterable, n: int):
         args = [iter(iterable)] * n
         return zip_longest(*args)
+
+    @staticmethod
+    def _adaptive_grouper(iterable, size: Callable[[], int]) -> Iterator[List]:
+        """Group items to lists, each as long as size() at the time the list is started"""
+        iterator = iter(iterable)
+        while True:
+            group = list(islice(iterator, size()))
+            if len(group) == 0:
+                return
+            yield group